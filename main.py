@@ -1,18 +1,26 @@
+import ctypes
+import ctypes.util
+import errno
 import logging
+import os
+import sqlite3
+import struct
 import sys
-from asyncio import Future
+from asyncio import CancelledError, Event, Future, create_task, get_running_loop
 from asyncio import run as run_async
-from collections import deque
-from concurrent.futures import ALL_COMPLETED, ThreadPoolExecutor, wait
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager, suppress
 from datetime import datetime, timezone
 from getpass import getuser
 from hashlib import md5, sha1, sha256
 from pathlib import Path, PurePath
-from shutil import rmtree
+from select import select
+from shutil import copystat, rmtree
+from stat import S_ISDIR, S_ISREG
 from subprocess import run
-from threading import Lock, Thread
-from time import sleep, time_ns
+from threading import Condition, Lock, Thread
+from time import sleep, time, time_ns
 from traceback import print_exc
 from typing import Literal, TypedDict
 from zlib import crc32
@@ -28,6 +36,7 @@ from fontTools.ttLib import TTFont, TTLibError
 from psutil import disk_partitions, disk_usage
 from pybase64 import b64encode
 from send2trash import send2trash
+from send2trash.exceptions import TrashPermissionError
 from toml import dumps as dumps_toml
 from toml import load as load_toml
 from ujson import dumps, loads
@@ -40,6 +49,11 @@ try:
 except ImportError:
     ...
 
+try:
+    from msgpack import packb
+except ImportError:
+    packb = None
+
 
 def measure(text):
     def wrapper(fn):
@@ -63,6 +77,22 @@ def with_measure(text):
     print(f'{text} took {(end - start) / 1_000_000} ms')
 
 
+def parse_size(size: str):
+    size = size.lower()
+
+    if size.endswith('gb'):
+        return int(size[:-2]) * 1024 * 1024 * 1024
+
+    if size.endswith('mb'):
+        return int(size[:-2]) * 1024 * 1024
+
+    if size.endswith('kb'):
+        return int(size[:-2]) * 1024
+
+    if size.endswith('b'):
+        return int(size[:-1])
+
+
 class ExplorerItem(TypedDict):
     name: str
     path: str
@@ -86,31 +116,267 @@ class Disk(TypedDict):
 
 
 def get_folder_size(path: Path):
-    if path.is_dir():
-        yield sum(get_folder_size(i) for i in path.iterdir())
-    elif path.is_file():
-        yield path.stat().st_size
-    yield 0
+    s = StreamFolderSize(path)
+    s.get_size()
 
+    return s.size
 
-def get_path_info(path: str):
-    p = Path(path)
-    stat = p.stat()
-
-    return ExplorerItem(
-        name=p.name,
-        path=p.as_posix(),
-        kind='folder' if p.is_dir() else 'file',
-        modified=datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
-        accessed=datetime.fromtimestamp(stat.st_atime, timezone.utc).isoformat(),
-        created=datetime.fromtimestamp(stat.st_ctime, timezone.utc).isoformat(),
-        type=get_file_type(p),
-        size=0,
-        parent=p.parent.as_posix(),
+
+def get_kind(stat: os.stat_result) -> Literal['file', 'folder'] | None:
+    if S_ISDIR(stat.st_mode):
+        return 'folder'
+
+    if S_ISREG(stat.st_mode):
+        return 'file'
+
+
+class Entry:
+    """
+    Compact listing entry, the streams and caches keep entries instead of ExplorerItems,
+    timestamps stay numbers and the parent string is shared, `to_item` builds the
+    ExplorerItem when it is sent
+    """
+
+    __slots__ = (
+        'name',
+        'parent',
+        'kind',
+        'type',
+        'modified',
+        'accessed',
+        'created',
+        'size',
     )
 
+    def __init__(self, name: str, parent: str, stat: os.stat_result):
+        kind = get_kind(stat)
+
+        self.name = name
+        self.parent = sys.intern(parent)
+        self.kind = kind or 'file'
+        self.type = get_type(name, kind)
+        self.modified = stat.st_mtime
+        self.accessed = stat.st_atime
+        self.created = stat.st_ctime
+        self.size = stat.st_size if kind == 'file' else 0
+
+    @property
+    def path(self):
+        return f'{self.parent.rstrip("/")}/{self.name}'
+
+    def to_item(self):
+        return ExplorerItem(
+            name=self.name,
+            path=self.path,
+            kind=self.kind,
+            modified=datetime.fromtimestamp(self.modified, timezone.utc).isoformat(),
+            accessed=datetime.fromtimestamp(self.accessed, timezone.utc).isoformat(),
+            created=datetime.fromtimestamp(self.created, timezone.utc).isoformat(),
+            type=self.type,
+            size=self.size,
+            parent=self.parent,
+        )
+
+
+def to_items(items: list):
+    return [i.to_item() if isinstance(i, Entry) else i for i in items]
+
+
+def to_columns(entries: list[Entry]):
+    """
+    Columnar form of the entries for the websocket, keys once and values as arrays,
+    timestamps in epoch ms, parents and types as indexes into `parents` and `types`,
+    the path is not sent (it is parent/name)
+    """
+    parents = {}
+    types = {}
+
+    return {
+        'name': [i.name for i in entries],
+        'kind': [i.kind for i in entries],
+        'modified': [int(i.modified * 1000) for i in entries],
+        'accessed': [int(i.accessed * 1000) for i in entries],
+        'created': [int(i.created * 1000) for i in entries],
+        'size': [i.size for i in entries],
+        'type': [types.setdefault(i.type, len(types)) for i in entries],
+        'types': list(types),
+        'parent': [parents.setdefault(i.parent, len(parents)) for i in entries],
+        'parents': list(parents),
+    }
+
+
+def get_path_entry(path: str):
+    p = Path(path)
+
+    return Entry(p.name, p.parent.as_posix(), p.stat())
+
+
+def get_path_info(path: str):
+    return get_path_entry(path).to_item()
+
+
+def get_entry(entry: os.DirEntry, parent: str):
+    """
+    Same as `get_path_entry`, but reuses what `os.scandir` already knows about the entry,
+    only one stat per entry (none on windows, the stat comes with the listing)
+    """
+    try:
+        stat = entry.stat()
+    except FileNotFoundError:
+        # Broken symlink
+        stat = entry.stat(follow_symlinks=False)
+
+    return Entry(entry.name, parent, stat)
+
+
+def scan_dir(path: Path):
+    parent = path.as_posix()
+
+    with os.scandir(path) as entries:
+        for entry in entries:
+            yield get_entry(entry, parent)
+
+
+def walk_parallel(roots: list, scan, workers=8, cancelled=lambda: False):
+    """
+    Runs `scan(job)` on a pool of threads sharing a stack of jobs, `scan` returns the
+    new jobs it found (e.g. the subfolders of a folder), iterative so deep trees don't
+    hit the recursion limit
+
+    Jobs are taken from the top of the stack, the walk goes depth first and the stack
+    stays small, any idle worker takes the next job
+    """
+    jobs = deque(roots)
+    # Jobs queued or running, the walk ends when it reaches 0
+    pending = len(jobs)
+    cond = Condition()
+
+    def worker():
+        nonlocal pending
+
+        while True:
+            with cond:
+                while not jobs and pending:
+                    cond.wait()
+
+                if not jobs:
+                    return
+
+                job = jobs.pop()
+
+            new = ()
+
+            try:
+                if not cancelled():
+                    new = scan(job) or ()
+            except OSError:
+                ...
+            except Exception:
+                print_exc()
+            finally:
+                with cond:
+                    jobs.extend(new)
+                    pending += len(new) - 1
+
+                    if pending == 0:
+                        cond.notify_all()
+                    else:
+                        cond.notify(len(new))
+
+    threads = [Thread(target=worker, daemon=True) for _ in range(workers)]
+
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+
+class IOScheduler:
+    """
+    Shares the disks between the streams, each device has `slots` concurrent I/O jobs
+    (a folder scan, a batch of files) and a waiting job of a higher priority class always
+    goes first. The background classes (size, hash, bulk) only use `background_slots`, the
+    rest is kept for listing and search, and the hash and bulk classes can be throttled to
+    `background_bandwidth` bytes/s (0 is unlimited)
+    """
+
+    INTERACTIVE = 0
+    SEARCH = 1
+    SIZE = 2
+    HASH = 3
+    BULK = 4
+
+    def __init__(self, slots=8, background_slots=4, background_bandwidth=0):
+        self.slots = slots
+        self.background_slots = min(background_slots, slots)
+        self.bandwidth = background_bandwidth
+        self.cond = Condition()
+        # Per device, running jobs and waiting jobs by priority class
+        self.running = {}
+        self.waiting = {}
+        self.tokens = background_bandwidth
+        self.refilled = time()
+        self.tokens_lock = Lock()
+
+    @staticmethod
+    def get_device(path: str | Path):
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            return 0
+
+    @contextmanager
+    def slot(self, priority: int, device: int):
+        limit = self.slots if priority < self.SIZE else self.background_slots
+
+        with self.cond:
+            waiting = self.waiting.setdefault(device, [0] * (self.BULK + 1))
+            waiting[priority] += 1
+
+            while self.running.get(device, 0) >= limit or any(waiting[:priority]):
+                self.cond.wait()
+
+            waiting[priority] -= 1
+            self.running[device] = self.running.get(device, 0) + 1
+
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.running[device] -= 1
+                self.cond.notify_all()
+
+    def wrap(self, scan, priority: int, path: str | Path):
+        """`scan` for `walk_parallel`, each job runs in a slot of the device of `path`"""
+
+        device = self.get_device(path)
+
+        def wrapper(job):
+            with self.slot(priority, device):
+                return scan(job)
+
+        return wrapper
+
+    def throttle(self, priority: int, n: int):
+        """Waits until `n` bytes of I/O fit in the bandwidth of the background jobs"""
+
+        if not self.bandwidth or priority < self.HASH:
+            return
+
+        with self.tokens_lock:
+            now = time()
+            # One second of burst
+            self.tokens = min(
+                self.bandwidth, self.tokens + (now - self.refilled) * self.bandwidth
+            )
+            self.refilled = now
+            self.tokens -= n
+            delay = -self.tokens / self.bandwidth if self.tokens < 0 else 0
+
+        if delay:
+            sleep(delay)
 
-file_type_cache = {}
 
 # fmt: off
 folders = {
@@ -1766,396 +2032,3022 @@ for i in [files, folders]:
         assert isinstance(v, tuple), f'{v} is not a tuple'
 
 
-def get_file_type(path: Path):
-    name = path.name
+def compile_types(types: dict[str, tuple[str, ...]]):
+    """
+    Trie of the reversed (lowercase) endings, a node where an ending finishes keeps
+    `(priority, type)` of the first type in `types` with that ending
+    """
+    trie = {}
 
-    if name in file_type_cache:
-        return file_type_cache[name]
+    for priority, (t, endings) in enumerate(types.items()):
+        for ending in endings:
+            node = trie
 
-    n = 'Unknown'
+            for char in reversed(ending.lower()):
+                node = node.setdefault(char, {})
 
-    if path.is_dir():
-        for t, ext in folders.items():
-            if any(name.endswith(i.lower()) for i in ext):
-                n = t
-                break
-        else:
-            n = 'folders/folder'
+            node.setdefault(None, (priority, t))
 
-    elif path.is_file():
-        for t, ext in files.items():
-            if any(name.endswith(i.lower()) for i in ext):
-                n = t
-                break
-        else:
-            n = 'files/file'
+    return trie
 
-    file_type_cache[name] = n
 
-    return n
+def match_type(trie: dict, name: str):
+    """First type (in the table order) with an ending of `name`, O(len(name))"""
 
+    best = trie.get(None)
+    node = trie
 
-class StreamFolderSize:
-    def __init__(self, path: str):
-        self.size = 0
-        self.path = Path(path)
+    for char in reversed(name):
+        node = node.get(char)
 
-    @property
-    def end(self):
-        return not self.thread.is_alive()
+        if node is None:
+            break
 
-    def start(self):
-        self.thread = Thread(target=self.get_size, args=(self.path,))
-        self.thread.start()
+        if None in node and (best is None or node[None] < best):
+            best = node[None]
 
-    def get_size(self, path: Path):
-        if path.is_dir():
-            for i in path.iterdir():
-                self.get_size(i)
-        elif path.is_file():
-            self.size += path.stat().st_size
+    return best and best[1]
 
-    def __eq__(self, other):
-        return self.path == other.path
 
+folders_trie = compile_types(folders)
+files_trie = compile_types(files)
 
-class StreamDelete:
-    def __init__(self, id: str, path: str | list[str], moveToTrash=True):
-        self.id = id
-        self.paths = path
-        self.end = False
-        self.items = []
-        self.total = 0
-        self.deleted = 0
-        self.moveToTrash = moveToTrash
-        self.last_deleted = None
 
-    def count(self, path):
-        if path.is_dir():
-            for i in path.iterdir():
-                self.count(i)
+def get_file_type(path: Path):
+    if path.is_dir():
+        return get_type(path.name, 'folder')
 
-        self.items.append(path)
+    if path.is_file():
+        return get_type(path.name, 'file')
 
-    def start(self):
-        self.thread = Thread(target=self.delete)
-        self.thread.start()
+    return get_type(path.name, None)
 
-    def delete(self):
-        for path in self.paths:
-            self.count(Path(path))
-        self.total = len(self.items)
 
-        def delete_file(path):
-            with suppress(FileNotFoundError):
-                path.unlink()
-            self.deleted += 1
-            self.last_deleted = path.as_posix()
+def get_type(name: str, kind: Literal['file', 'folder'] | None):
+    # The endings are lowercase, so are the names
+    name = name.lower()
+    n = file_type_cache.get((kind, name))
 
-        def delete_folder(path):
-            with suppress(FileNotFoundError):
-                path.rmdir()
-            self.deleted += 1
-            self.last_deleted = path.as_posix()
+    if n is not None:
+        return n
 
-        def move_to_trash(path):
-            try:
-                send2trash(path)
-            except OSError as e:
-                print(e)
-                raise
+    n = 'Unknown'
 
-            self.deleted += 1
-            self.last_deleted = path.as_posix()
+    if kind == 'folder':
+        n = match_type(folders_trie, name) or 'folders/folder'
 
-        tasks = []
-        with ThreadPoolExecutor(max_workers=16) as executor:
-            for i in self.items:
-                if i.is_file():
-                    if self.moveToTrash:
-                        tasks.append(executor.submit(move_to_trash, i))
-                    else:
-                        tasks.append(executor.submit(delete_file, i))
+    elif kind == 'file':
+        n = match_type(files_trie, name) or 'files/file'
 
-            wait(tasks, return_when=ALL_COMPLETED)
+    file_type_cache.set((kind, name), n)
 
-            for i in self.items:
-                if i.is_dir():
-                    if self.moveToTrash:
-                        tasks.append(executor.submit(move_to_trash, i))
-                    else:
-                        tasks.append(executor.submit(delete_folder, i))
+    return n
 
-        self.end = True
 
-    def __eq__(self, other):
-        return self.path == other.path
+class LRUCache:
+    """
+    Thread-safe LRU, evicts the least recently used keys while the sum of
+    `sizeof(value)` is bigger than `maxsize`
+    """
 
+    def __init__(self, maxsize: int, sizeof=lambda value: 1):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.data = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.data.move_to_end(key)
+
+            return self.data[key][0]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+
+        with self.lock:
+            if key in self.data:
+                self.size -= self.data.pop(key)[1]
+
+            if size > self.maxsize:
+                return
+
+            self.data[key] = (value, size)
+            self.size += size
+
+            while self.size > self.maxsize:
+                _, (_, old_size) = self.data.popitem(last=False)
+                self.size -= old_size
+
+    def pop(self, key):
+        with self.lock:
+            if key in self.data:
+                self.size -= self.data.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'maxsize': self.maxsize,
+            'entries': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
 
-class StreamFind:
-    def __init__(self, path: str, query: str):
-        self.path = Path(path)
-        self.query = query
-        self.end = False
-        self.items = []
-        self.total = 0
-        self.regex = self.create_regex(query)
 
-    def start(self):
-        self.thread = Thread(target=self.find)
-        self.thread.start()
+def get_entries_size(entries: list[Entry]):
+    # Rough memory used by the entries (the parent is shared), enough to keep the cache
+    # under the configured size
+    return sum(sys.getsizeof(i) + sys.getsizeof(i.name) + 4 * 24 for i in entries)
 
-    def create_regex(self, search: str):
-        flags = {
-            'i': re.I,
-            'm': re.M,
-            's': re.S,
-            'x': re.X,
-            'a': re.A,
-            'u': re.U,
-            'l': re.L,
-        }
-        is_regex = re.search(r'\/(?<regex>.+)\/(?<flags>.*)', search)
 
-        if is_regex:
-            parsed_flags = 0
+class DirCache:
+    """
+    Values computed from a folder (its listed items, its size), valid while the folder
+    mtime and inode don't change
 
-            for i in is_regex.group('flags'):
-                parsed_flags |= flags.get(i, 0)
+    Creating, deleting or renaming an entry updates the folder mtime, so back/forward
+    navigation to an unchanged folder doesn't need to list it again
+    """
 
-            return re.compile(is_regex.group('regex'), parsed_flags)
+    def __init__(self, max_memory: int, sizeof=get_entries_size):
+        self.sizeof = sizeof
+        self.cache = LRUCache(max_memory, sizeof=lambda v: v[2])
 
-        return re.compile(re.escape(search), re.I)
+    def get(self, path: Path, stat: os.stat_result | None = None):
+        key = path.as_posix()
+        cached = self.cache.get(key)
 
-    def find(self):
-        paths = deque([self.path])
+        if cached is None:
+            return
 
-        while paths:
-            path = paths.popleft()
+        (mtime, ino), value, _ = cached
 
-            for i in path.iterdir():
-                if i.is_dir():
-                    paths.append(i)
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self.cache.pop(key)
+                return
 
-                if self.regex.search(i.name) or PurePath(i.name).match(self.query):
-                    self.items.append(get_path_info(i.as_posix()))
+        if (stat.st_mtime_ns, stat.st_ino) != (mtime, ino):
+            self.cache.pop(key)
+            return
 
-                self.total += 1
+        return value
 
-        self.end = True
+    # stat must be taken before reading the folder, if the folder changes meanwhile
+    # the next `get` will see a different mtime
+    def set(self, path: Path, stat: os.stat_result, value):
+        self.cache.set(
+            path.as_posix(),
+            ((stat.st_mtime_ns, stat.st_ino), value, self.sizeof(value)),
+        )
 
-    def __eq__(self, other):
-        return self.path == other.path
+    def invalidate(self, path: Path):
+        self.cache.pop(path.as_posix())
 
 
-class StreamLs:
-    def __init__(self, path: str):
-        self.path = Path(path)
-        self.end = False
-        self.items = []
-        self.total = 0
-        self.paused = False
+class FolderSizes:
+    """Last measured size of the folders, `version` changes with every measure"""
 
-    def start(self):
-        self.thread = Thread(target=self.ls)
-        self.thread.start()
+    def __init__(self, maxsize: int):
+        self.cache = LRUCache(maxsize)
+        self.version = 0
 
-    def pause(self):
-        self.paused = True
+    def set(self, path: Path, size: int, children: dict[str, int]):
+        self.cache.set(path.as_posix(), size)
 
-    def resume(self):
-        self.paused = False
+        for name, child_size in children.items():
+            self.cache.set((path / name).as_posix(), child_size)
 
-    def ls(self):
-        def get(path: Path):
-            self.items.append(get_path_info(path.as_posix()))
-            self.total += 1
+        self.version += 1
 
-            while self.paused:
-                sleep(0.001)
+    def get(self, path: str) -> int | None:
+        return self.cache.get(path)
 
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            for i in self.path.iterdir():
-                executor.submit(get, i)
 
-        self.end = True
+class Listing:
+    """
+    Entries of a folder and their sort orders, each order is computed once from
+    precomputed keys and windows are sliced from it
+    """
 
-    def __eq__(self, other):
-        return self.path == other.path
+    SORT_KEYS = {
+        'name': lambda e: e.name,
+        'modified': lambda e: e.modified,
+        'type': lambda e: (e.kind, e.type),
+        'size': lambda e: e.size if e.kind == 'file' else folder_sizes.get(e.path) or 0,
+    }
 
+    def __init__(self, entries: list[Entry], stat: os.stat_result):
+        self.entries = entries
+        self.stamp = (stat.st_mtime_ns, stat.st_ino)
+        self.orders = {}
+        self.names = None
+        self.filtered = (None, None)
+        self.lock = Lock()
 
-class API:
-    def close(self):
-        w.destroy()
+    def order(self, sort: str):
+        """The entries indexes sorted by `sort` and the version they were sorted at"""
 
-    def minimize(self):
-        w.minimize()
+        # Folder sizes can be measured after the listing
+        version = folder_sizes.version if sort == 'size' else 0
 
-    def maximize(self):
-        w.toggle_fullscreen()
+        with self.lock:
+            if sort in self.orders and self.orders[sort][0] == version:
+                return self.orders[sort]
 
-    def get_path_info(self, path: str):
-        return get_path_info(path)
+            keys = [*map(self.SORT_KEYS[sort], self.entries)]
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            self.orders[sort] = (version, order)
 
-    def start_ls(self, folder: str):
-        s = StreamLs(folder)
-        s.start()
-        streams_ls[folder] = s
+            return version, order
 
-    def start_find(self, path: str, query: str):
-        s = StreamFind(path, query)
-        s.start()
-        streams_finds[path] = s
+    def filter(self, sort: str, text: str):
+        version, order = self.order(sort)
+        key = (sort, version, text.lower())
 
-    def start_folder_size(self, path: str):
-        s = StreamFolderSize(path)
-        s.start()
-        streams_files[path] = s
+        with self.lock:
+            if self.filtered[0] == key:
+                return self.filtered[1]
 
-    def start_delete(self, id: str, path: str, moveToTrash=True):
-        s = StreamDelete(id, path, moveToTrash)
-        s.start()
-        streams_deletes[id] = s
+            if self.names is None:
+                self.names = [i.name.lower() for i in self.entries]
 
-    def ls(self, folder: str):
-        if folder not in streams_ls:
-            return
+            filtered = [i for i in order if key[2] in self.names[i]]
+            # Only the last filter is kept, it is the one being typed
+            self.filtered = (key, filtered)
 
-        streams_ls[folder].pause()
+            return filtered
 
-        # Need copy items, else items is passed by reference and will be empty after clear
-        r = {'items': [*streams_ls[folder].items], 'end': streams_ls[folder].end}
-        streams_ls[folder].items.clear()
+    def window(self, sort: str, offset: int, limit: int, reverse=False, text=''):
+        if text:
+            order = self.filter(sort, text)
+        else:
+            _, order = self.order(sort)
 
-        streams_ls[folder].resume()
+        total = len(order)
 
-        if streams_ls[folder].end:
-            del streams_ls[folder]
+        if reverse:
+            indexes = order[max(0, total - offset - limit) : max(0, total - offset)][
+                ::-1
+            ]
+        else:
+            indexes = order[offset : offset + limit]
 
-        return r
+        return {'items': to_items([self.entries[i] for i in indexes]), 'total': total}
 
-    def stream_folder_size(self, path: str | list[str]):
-        if path not in streams_files:
-            return
 
-        r = {'size': streams_files[path].size, 'end': streams_files[path].end}
+def get_listing(folder: str):
+    path = Path(folder)
+    key = path.as_posix()
+    stat = os.stat(path)
+    listing = listings.get(key)
 
-        if streams_files[path].end:
-            del streams_files[path]
+    if listing is not None and listing.stamp == (stat.st_mtime_ns, stat.st_ino):
+        return listing
 
-        return r
+    entries = ls_cache.get(path, stat)
 
-    def stream_delete(self, id: str):
-        if id not in streams_deletes:
-            return
+    if entries is None:
+        entries = list(scan_dir(path))
+        ls_cache.set(path, stat, entries)
 
-        r = {
-            'end': streams_deletes[id].end,
-            'total': streams_deletes[id].total,
-            'deleted': streams_deletes[id].deleted,
-            'last_deleted': streams_deletes[id].last_deleted,
-        }
+    listing = Listing(entries, stat)
+    listings.set(key, listing)
 
-        if streams_deletes[id].end:
-            del streams_deletes[id]
+    return listing
 
-        return r
 
-    def stream_find(self, path: str):
-        if path not in streams_finds:
-            return
+class LineIndex:
+    """
+    Byte offsets of every `every` lines of a text file, built while the file is paged
+    so only the part of the file before the requested lines is ever scanned
+    """
 
-        r = {
-            'end': streams_finds[path].end,
-            'total': streams_finds[path].total,
-            'files': streams_finds[path].items,
-        }
+    def __init__(self, path: str, stat: os.stat_result, every=1024, chunk_size=1 << 20):
+        self.path = path
+        self.stamp = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        self.every = every
+        self.chunk_size = chunk_size
+        # checkpoints[i] is the offset of the line i * every
+        self.checkpoints = [0]
+        self.lines = 0
+        self.offset = 0
+        self.last = b'\n'
+        self.complete = False
+        self.lock = Lock()
 
-        streams_finds[path].items = []
+    @property
+    def total(self) -> int | None:
+        """Number of lines, None until the whole file was scanned"""
 
-        if streams_finds[path].end:
-            del streams_finds[path]
+        if not self.complete:
+            return None
 
-        return r
+        # The last line doesn't always end with a newline
+        return self.lines + (self.last != b'\n')
 
-    def home(self):
-        return Path.home().as_posix()
+    def seek(self, line: int, ahead=0) -> tuple[int, int]:
+        """Nearest indexed line before `line` and its offset, indexing `ahead` lines more"""
 
-    def rename(self, path: str, name: str):
-        Path(path).rename(Path(path).parent / name)
+        with self.lock:
+            if self.lines < line + ahead and not self.complete:
+                self.scan(line + ahead)
 
-    def create_file(self, path: str):
-        Path(path).touch()
+            i = min(line // self.every, len(self.checkpoints) - 1)
 
-    def create_folder(self, path: str):
-        Path(path).mkdir()
+            return i * self.every, self.checkpoints[i]
 
-    def exists(self, path: str):
-        return Path(path).exists()
+    def scan(self, line: int):
+        with open(self.path, 'rb', buffering=0) as f:
+            f.seek(self.offset)
 
-    def delete_all_streams_ls(self):
-        streams_ls.clear()
+            while self.lines < line:
+                chunk = f.read(self.chunk_size)
 
-    def delete_all_streams_find(self):
-        streams_finds.clear()
+                if not chunk:
+                    self.complete = True
+                    break
 
-    def delete_all_streams_folder_size(self):
-        streams_files.clear()
+                n = chunk.count(b'\n')
 
-    def delete_all_streams_delete(self):
-        streams_deletes.clear()
+                # Only look for the newlines when a checkpoint is in the chunk
+                if self.lines + n >= len(self.checkpoints) * self.every:
+                    lines = self.lines
+                    pos = chunk.find(b'\n')
 
-    def get_config(self):
-        return load_toml(CONFIG_FILE)
+                    while pos != -1:
+                        lines += 1
 
-    def set_config(self, config: dict):
-        CONFIG_FILE.write_text(dumps_toml(config))
+                        if lines == len(self.checkpoints) * self.every:
+                            self.checkpoints.append(self.offset + pos + 1)
 
-    def read(self, path: str):
-        try:
-            return Path(path).read_text('utf-8')
-        except UnicodeDecodeError:
-            return Path(path).read_text('iso-8859-1')
+                        pos = chunk.find(b'\n', pos + 1)
 
-    def read_b64(self, path: str):
-        return b64encode(Path(path).read_bytes()).decode()
+                self.lines += n
+                self.offset += len(chunk)
+                self.last = chunk[-1:]
 
-    def user(self):
-        return getuser()
 
-    def pwd(self):
-        return Path('').absolute().as_posix()
+def get_line_index(path: str):
+    stat = os.stat(path)
+    index = line_indexes.get(path)
 
-    def setup_tests(self):
-        tests = Path('__tests')
+    if index is None or index.stamp != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+        index = LineIndex(path, stat)
+        line_indexes.set(path, index)
 
-        if tests.exists():
-            rmtree(tests)
+    return index
 
-        tests.mkdir()
 
-        for i in range(1000):
-            tests.joinpath(f'{i}').touch()
+def decode(data: bytes):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('iso-8859-1')
 
-        tests.joinpath('test.txt').touch()
-        tests.joinpath('foo.py').touch()
-        tests.joinpath('bar.py').touch()
 
-    def clear_tests(self):
-        rmtree('__tests')
+class CancelToken:
+    """Cooperative cancellation, the walk loops check it and stop early"""
 
-    def disks_info(self):
-        c = wmi.WMI()
+    def __init__(self):
+        self.cancelled = False
 
-        disks: list[Disk] = []
+    def cancel(self):
+        self.cancelled = True
 
-        for i in disk_partitions():
-            d = next(
-                d for d in c.Win32_LogicalDisk() if i.mountpoint.startswith(d.Caption)
-            )
-            usage = disk_usage(i.mountpoint)
+    # Usable as the `cancelled` callback of `walk_parallel`
+    def __call__(self):
+        return self.cancelled
 
-            disks.append(
+
+class Stream:
+    """
+    Items produced by a stream thread are buffered in `items` until someone takes them,
+    either the UI polling (`API.ls`, `API.stream_find`) or a websocket subscription
+
+    `cancel` asks the stream thread to stop, the stream still finishes with `end`
+    """
+
+    def __init__(self):
+        self.end = False
+        self.items = []
+        self.items_lock = Lock()
+        self.listeners = []
+        self.token = CancelToken()
+
+    @property
+    def cancelled(self):
+        return self.token.cancelled
+
+    def cancel(self):
+        self.token.cancel()
+
+    def push(self, item):
+        with self.items_lock:
+            self.items.append(item)
+
+        self.notify()
+
+    def extend(self, items: list):
+        with self.items_lock:
+            self.items.extend(items)
+
+        self.notify()
+
+    def take(self):
+        with self.items_lock:
+            items, self.items = self.items, []
+
+        return items
+
+    def finish(self):
+        self.end = True
+        self.notify()
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with suppress(ValueError):
+            self.listeners.remove(listener)
+
+    def notify(self):
+        for listener in self.listeners:
+            listener()
+
+    # Sent with each batch of items
+    def status(self):
+        return {'total': self.total}
+
+
+class Subscriber:
+    """
+    Wakes up the websocket task that pushes a stream, called from the stream threads
+
+    Only the first notification of a batch crosses to the event loop, the items pushed
+    while the socket is busy sending are sent together in the next batch
+    """
+
+    def __init__(self):
+        self.loop = get_running_loop()
+        self.event = Event()
+        self.pending = False
+
+    def __call__(self):
+        if not self.pending:
+            self.pending = True
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    async def wait(self):
+        await self.event.wait()
+        self.event.clear()
+        self.pending = False
+
+
+class StreamFolderSize(Stream):
+    """
+    Size of a folder, `size` is updated while walking and `children` has the size of each
+    direct child, hard links are counted once and symlinks are not followed
+
+    `previous` is the size measured last time (`folder_sizes`), shown until the walk ends.
+    Every measure walks the whole tree, the folder mtimes don't change when a file in
+    them grows so the subtrees can't be reused
+    """
+
+    def __init__(self, path: str, workers=8):
+        super().__init__()
+        self.size = 0
+        self.children = {}
+        self.path = Path(path)
+        self.previous = folder_sizes.get(self.path.as_posix())
+        self.workers = workers
+        self.lock = Lock()
+        self.inodes = set()
+
+    def start(self):
+        self.thread = Thread(target=self.get_size)
+        self.thread.start()
+
+    def get_size(self):
+        try:
+            stat = self.path.stat()
+
+            if S_ISDIR(stat.st_mode):
+                walk_parallel(
+                    [(self.path, None)],
+                    io_scheduler.wrap(self.scan, IOScheduler.SIZE, self.path),
+                    self.workers,
+                    self.token,
+                )
+
+                if not self.cancelled:
+                    folder_sizes.set(self.path, self.size, self.children)
+            elif S_ISREG(stat.st_mode):
+                self.size = stat.st_size
+        finally:
+            self.finish()
+
+    def scan(self, job: tuple[str, str | None]):
+        folder, child = job
+        folders = []
+        sizes = {}
+
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                # Sizes of the root entries are reported by name, deeper entries
+                # count to the root entry they are in
+                name = child if child is not None else entry.name
+
+                with suppress(FileNotFoundError):
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append((entry.path, name))
+                        sizes.setdefault(name, 0)
+
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+
+                        if stat.st_nlink > 1 and stat.st_ino:
+                            with self.lock:
+                                if (stat.st_dev, stat.st_ino) in self.inodes:
+                                    continue
+                                self.inodes.add((stat.st_dev, stat.st_ino))
+
+                        sizes[name] = sizes.get(name, 0) + stat.st_size
+
+        with self.lock:
+            for name, size in sizes.items():
+                self.children[name] = self.children.get(name, 0) + size
+                self.size += size
+
+        return folders
+
+    def __eq__(self, other):
+        return self.path == other.path
+
+
+class CRC32:
+    """hashlib-like interface for `zlib.crc32`"""
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = crc32(data, self.value)
+
+    def hexdigest(self):
+        return f'{self.value & 0xFFFFFFFF:08x}'
+
+
+HASHES = {'crc32': CRC32, 'md5': md5, 'sha1': sha1, 'sha256': sha256}
+
+
+def hash_file(
+    path: str, algorithms: list[str], buffer_size=1 << 20, progress=None, cancelled=None
+):
+    """
+    Digests of the file for each of `algorithms`, computed in one pass, `progress` is
+    called with the bytes read after each buffer, returns None if `cancelled`
+    """
+
+    hashes = {name: HASHES[name]() for name in algorithms}
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+
+    with open(path, 'rb', buffering=0) as f:
+        while n := f.readinto(buffer):
+            if cancelled and cancelled():
+                return None
+
+            # Both hashlib and zlib release the GIL on large buffers
+            for h in hashes.values():
+                h.update(view[:n])
+
+            if progress:
+                progress(n)
+
+    return {name: h.hexdigest() for name, h in hashes.items()}
+
+
+class HashCache:
+    """
+    Digests of the files hashed before, in a sqlite database, valid while the size, mtime
+    and inode of the file are the same. The least recently used files are evicted after
+    `max_entries` files
+    """
+
+    def __init__(self, path: Path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+
+        with self.connect() as db:
+            db.executescript("""
+                PRAGMA journal_mode = WAL;
+
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    used INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS digests (
+                    path TEXT NOT NULL REFERENCES files (path) ON DELETE CASCADE,
+                    algorithm TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (path, algorithm)
+                );
+                CREATE INDEX IF NOT EXISTS files_used ON files (used);
+                """)
+
+    @contextmanager
+    def connect(self):
+        """Committed, or rolled back on errors, and closed when the block exits"""
+
+        db = sqlite3.connect(self.path, check_same_thread=False)
+
+        try:
+            db.execute('PRAGMA foreign_keys = ON')
+
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, path: str, stat: os.stat_result) -> dict[str, str]:
+        with self.connect() as db:
+            found = db.execute(
+                'SELECT size, mtime, inode FROM files WHERE path = ?', (path,)
+            ).fetchone()
+
+            if found is None:
+                return {}
+
+            if found != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+                db.execute('DELETE FROM files WHERE path = ?', (path,))
+                return {}
+
+            db.execute('UPDATE files SET used = ? WHERE path = ?', (time_ns(), path))
+
+            return dict(
+                db.execute(
+                    'SELECT algorithm, digest FROM digests WHERE path = ?', (path,)
+                )
+            )
+
+    def set(self, path: str, stat: os.stat_result, digests: dict[str, str]):
+        with self.connect() as db:
+            stamp = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+            found = db.execute(
+                'SELECT size, mtime, inode FROM files WHERE path = ?', (path,)
+            ).fetchone()
+
+            if found is not None and found != stamp:
+                db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+            db.execute(
+                """
+                INSERT INTO files (path, size, mtime, inode, used) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET used = excluded.used
+                """,
+                (path, *stamp, time_ns()),
+            )
+            db.executemany(
+                'INSERT OR REPLACE INTO digests (path, algorithm, digest) VALUES (?, ?, ?)',
+                [(path, *i) for i in digests.items()],
+            )
+            db.execute(
+                """
+                DELETE FROM files WHERE path IN (
+                    SELECT path FROM files ORDER BY used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+
+def get_digests(
+    path: str, algorithms: list[str], buffer_size=1 << 20, progress=None, cancelled=None
+):
+    """`hash_file` that only reads the file for the digests missing in `hash_cache`"""
+
+    path = Path(path).absolute().as_posix()
+    stat = os.stat(path)
+    digests = hash_cache.get(path, stat)
+    missing = [i for i in algorithms if i not in digests]
+
+    if missing:
+        computed = hash_file(path, missing, buffer_size, progress, cancelled)
+
+        if computed is None:
+            return None
+
+        # The file changed while hashing
+        after = os.stat(path)
+
+        if (after.st_size, after.st_mtime_ns, after.st_ino) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+        ):
+            hash_cache.set(path, stat, computed)
+
+        digests |= computed
+    elif progress:
+        progress(stat.st_size)
+
+    return {i: digests[i] for i in algorithms}
+
+
+class StreamHash(Stream):
+    """Digests of a file, `processed` is the bytes hashed so far out of `size`"""
+
+    def __init__(self, path: str, algorithms: list[str], buffer_size=1 << 20):
+        super().__init__()
+        self.path = path
+        self.algorithms = [i for i in algorithms if i in HASHES]
+        self.buffer_size = buffer_size
+        self.size = 0
+        self.processed = 0
+        self.digests = {}
+
+    def start(self):
+        self.thread = Thread(target=self.hash)
+        self.thread.start()
+
+    def hash(self):
+        try:
+            stat = os.stat(self.path)
+            self.size = stat.st_size
+
+            with io_scheduler.slot(IOScheduler.HASH, stat.st_dev):
+                self.digests = (
+                    get_digests(
+                        self.path,
+                        self.algorithms,
+                        self.buffer_size,
+                        self.progress,
+                        self.token,
+                    )
+                    or {}
+                )
+        finally:
+            self.finish()
+
+    def progress(self, n: int):
+        io_scheduler.throttle(IOScheduler.HASH, n)
+        self.processed += n
+
+    def status(self):
+        return {'processed': self.processed, 'size': self.size}
+
+
+class StreamDuplicates(Stream):
+    """
+    Groups of identical files under a folder, `{'size': int, 'digest': str, 'paths': [str]}`
+
+    Files are grouped by size while walking, then each size is compared by a hash of the
+    first and last `partial_size` bytes and only the files still alike are fully hashed.
+    Hard links are the same file and not duplicates, symlinks are not followed
+    """
+
+    def __init__(
+        self, path: str, workers=8, min_size=1, partial_size=4096, cached_size=1 << 20
+    ):
+        super().__init__()
+        self.path = Path(path)
+        self.workers = workers
+        self.min_size = min_size
+        self.partial_size = partial_size
+        self.cached_size = cached_size
+        self.lock = Lock()
+        self.sizes = {}
+        self.inodes = set()
+        self.stage = 'scan'
+        self.total = 0
+        self.hashed = 0
+        self.groups = 0
+        self.wasted = 0
+
+    def start(self):
+        self.thread = Thread(target=self.find)
+        self.thread.start()
+
+    def find(self):
+        try:
+            walk_parallel(
+                [self.path.as_posix()],
+                io_scheduler.wrap(self.scan, IOScheduler.SIZE, self.path),
+                self.workers,
+                self.token,
+            )
+
+            self.stage = 'hash'
+
+            # Biggest first, they waste the most space
+            buckets = sorted(
+                ((size, paths) for size, paths in self.sizes.items() if len(paths) > 1),
+                reverse=True,
+            )
+            self.sizes = {}
+
+            compare = io_scheduler.wrap(
+                lambda i: self.compare(*i), IOScheduler.HASH, self.path
+            )
+
+            # A cancelled walk leaves the buckets incomplete, `compare` returns right away
+            with ThreadPoolExecutor(self.workers) as executor:
+                for _ in executor.map(compare, buckets):
+                    ...
+        finally:
+            self.finish()
+
+    def scan(self, folder: str):
+        folders = []
+        files = []
+
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                with suppress(FileNotFoundError):
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+
+                        if stat.st_size < self.min_size:
+                            continue
+
+                        # Only the hard links, DirEntry has no inode on Windows
+                        if stat.st_nlink > 1 and stat.st_ino:
+                            inode = (stat.st_dev, stat.st_ino)
+                        else:
+                            inode = None
+
+                        files.append((inode, stat.st_size, entry.path))
+
+        with self.lock:
+            for inode, size, path in files:
+                if inode is not None:
+                    if inode in self.inodes:
+                        continue
+                    self.inodes.add(inode)
+
+                self.sizes.setdefault(size, []).append(path)
+
+            self.total += len(files)
+
+        return folders
+
+    def compare(self, size: int, paths: list[str]):
+        # Small files are read whole by the partial hash anyway
+        if size > 2 * self.partial_size:
+            groups = self.group(paths, self.hash_partial).values()
+        else:
+            groups = [paths]
+
+        for group in groups:
+            for digest, duplicates in self.group(
+                group, lambda i: self.hash_full(i, size)
+            ).items():
+                with self.lock:
+                    self.groups += 1
+                    self.wasted += size * (len(duplicates) - 1)
+
+                self.push({'size': size, 'digest': digest, 'paths': sorted(duplicates)})
+
+    def group(self, paths: list[str], hash):
+        """Paths by their `hash`, only the hashes shared by several paths"""
+
+        groups = {}
+
+        for path in paths:
+            if self.cancelled:
+                return {}
+
+            with suppress(OSError):
+                groups.setdefault(hash(path), []).append(path)
+
+        return {k: v for k, v in groups.items() if len(v) > 1}
+
+    def hash_partial(self, path: str):
+        with open(path, 'rb', buffering=0) as f:
+            head = f.read(self.partial_size)
+            f.seek(-self.partial_size, os.SEEK_END)
+            tail = f.read(self.partial_size)
+
+        with self.lock:
+            self.hashed += len(head) + len(tail)
+
+        io_scheduler.throttle(IOScheduler.HASH, len(head) + len(tail))
+
+        return sha1(head + tail).digest()
+
+    def hash_full(self, path: str, size: int):
+        # Small files hash faster than a lookup in `hash_cache`
+        get = get_digests if size >= self.cached_size else hash_file
+        digests = get(path, ['sha256'], progress=self.progress, cancelled=self.token)
+
+        if digests is None:
+            raise OSError('Cancelled')
+
+        return digests['sha256']
+
+    def progress(self, n: int):
+        io_scheduler.throttle(IOScheduler.HASH, n)
+
+        with self.lock:
+            self.hashed += n
+
+    def status(self):
+        return {
+            'stage': self.stage,
+            'total': self.total,
+            'hashed': self.hashed,
+            'found': self.groups,
+            'wasted': self.wasted,
+        }
+
+
+def get_tree_size(path: str, workers=8, cancelled=lambda: False) -> tuple[int, int]:
+    """Entries and bytes of the files in `path`, itself included"""
+
+    try:
+        stat = os.lstat(path)
+    except FileNotFoundError:
+        return 0, 0
+
+    entries = 1
+    size = stat.st_size if S_ISREG(stat.st_mode) else 0
+
+    if not S_ISDIR(stat.st_mode):
+        return entries, size
+
+    lock = Lock()
+
+    def scan(folder: str):
+        nonlocal entries, size
+
+        folders = []
+        n = 0
+        folder_size = 0
+
+        with os.scandir(folder) as it:
+            for entry in it:
+                with suppress(FileNotFoundError):
+                    n += 1
+
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        folder_size += entry.stat(follow_symlinks=False).st_size
+
+        with lock:
+            entries += n
+            size += folder_size
+
+        return folders
+
+    walk_parallel(
+        [path], io_scheduler.wrap(scan, IOScheduler.BULK, path), workers, cancelled
+    )
+
+    return entries, size
+
+
+class DeleteNode:
+    """A folder being deleted, removed when its `pending` subfolders are removed"""
+
+    __slots__ = ('path', 'parent', 'pending')
+
+    def __init__(self, path: str, parent: 'DeleteNode | None'):
+        self.path = path
+        self.parent = parent
+        self.pending = 0
+
+
+class StreamDelete(Stream):
+    """
+    Deletes files and folders, `total` is the entries found so far and `deleted` the
+    entries removed
+
+    Permanent deletes stream in post-order: the files of a folder are unlinked as soon as
+    it is listed and a folder is removed once its last subfolder is removed, only the
+    folders being deleted are kept in memory
+
+    Trash moves each selected path in one operation (a rename when the trash is on the
+    same device), the progress is per selected path. A folder that can't be trashed whole
+    because of something in it is trashed entry by entry, not when the device has no
+    usable trash
+    """
+
+    def __init__(self, id: str, path: str | list[str], moveToTrash=True, workers=8):
+        super().__init__()
+        self.id = id
+        self.paths = [path] if isinstance(path, str) else path
+        self.total = 0
+        self.deleted = 0
+        self.errors = 0
+        self.moveToTrash = moveToTrash
+        self.workers = workers
+        self.last_deleted = None
+        self.lock = Lock()
+
+    def start(self):
+        self.thread = Thread(target=self.delete)
+        self.thread.start()
+
+    def delete(self):
+        try:
+            if self.moveToTrash:
+                self.trash()
+            else:
+                self.remove()
+        finally:
+            self.finish()
+
+    def trash(self):
+        self.total = len(self.paths)
+
+        for path in self.paths:
+            if self.cancelled:
+                break
+
+            # Already trashed before a resume
+            if os.path.lexists(path):
+                self.trash_path(path)
+
+    def trash_path(self, root: str):
+        """Trashes `root`, or each of its entries if it can't be trashed whole"""
+
+        # (path, True) removes the folder after its entries were trashed
+        stack = [(root, False)]
+
+        while stack:
+            if self.cancelled:
+                return
+
+            path, emptied = stack.pop()
+
+            if emptied:
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    self.fail()
+                    continue
+
+                self.done(1, path)
+                continue
+
+            try:
+                send2trash(path)
+            except FileNotFoundError:
+                continue
+            except TrashPermissionError as e:
+                # No usable trash on the device, its entries would fail the same way
+                print(e)
+                self.fail()
+                return
+            except OSError as e:
+                if not os.path.isdir(path) or os.path.islink(path):
+                    print(e)
+                    self.fail()
+                    continue
+
+                try:
+                    with os.scandir(path) as it:
+                        children = [i.path for i in it]
+                except OSError:
+                    print(e)
+                    self.fail()
+                    continue
+
+                with self.lock:
+                    self.total += len(children)
+
+                stack.append((path, True))
+                stack.extend((i, False) for i in children)
+                continue
+
+            self.done(1, path)
+
+    def remove(self):
+        roots = []
+
+        for path in self.paths:
+            if os.path.isdir(path) and not os.path.islink(path):
+                roots.append(DeleteNode(path, None))
+            else:
+                self.total += 1
+                self.unlink(path)
+
+        self.total += len(roots)
+
+        for root in roots:
+            scan = io_scheduler.wrap(self.scan, IOScheduler.BULK, root.path)
+            walk_parallel([root], scan, self.workers, self.token)
+
+    def scan(self, node: DeleteNode):
+        folders = []
+        files = []
+
+        # walk_parallel ignores OSError, the folder and its parents are kept so it must
+        # count as a failed delete
+        try:
+            with os.scandir(node.path) as entries:
+                for entry in entries:
+                    with suppress(FileNotFoundError):
+                        if entry.is_dir(follow_symlinks=False):
+                            folders.append(DeleteNode(entry.path, node))
+                        else:
+                            files.append(entry.path)
+        except OSError:
+            self.fail()
+            return []
+
+        with self.lock:
+            self.total += len(files) + len(folders)
+            node.pending = len(folders)
+
+        for path in files:
+            if self.cancelled:
+                return []
+
+            self.unlink(path)
+
+        if not folders:
+            self.rmdir(node)
+
+        return folders
+
+    def unlink(self, path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            ...
+        except OSError:
+            self.fail()
+            return
+
+        self.done(1, path)
+
+    def rmdir(self, node: DeleteNode):
+        """Removes the folder and the parents it was the last pending subfolder of"""
+
+        while node is not None and not self.cancelled:
+            try:
+                os.rmdir(node.path)
+            except FileNotFoundError:
+                ...
+            except OSError:
+                # Something in it could not be deleted, neither can its parents
+                self.fail()
+                return
+
+            self.done(1, node.path)
+
+            node = node.parent
+
+            if node is None:
+                return
+
+            with self.lock:
+                node.pending -= 1
+
+                if node.pending:
+                    return
+
+    def done(self, n: int, path: str):
+        with self.lock:
+            self.deleted += n
+
+        self.last_deleted = Path(path).as_posix()
+
+    def fail(self):
+        with self.lock:
+            self.errors += 1
+
+    def status(self):
+        return {
+            'total': self.total,
+            'deleted': self.deleted,
+            'errors': self.errors,
+        }
+
+    def __eq__(self, other):
+        return self.id == other.id
+
+
+def get_free_name(path: str):
+    """`path` or the first of 'name (1).ext', 'name (2).ext'... that doesn't exist"""
+
+    if not os.path.lexists(path):
+        return path
+
+    root, ext = os.path.splitext(path)
+
+    if os.path.isdir(path):
+        root, ext = path, ''
+
+    i = 1
+
+    while os.path.lexists(f'{root} ({i}){ext}'):
+        i += 1
+
+    return f'{root} ({i}){ext}'
+
+
+class StreamCopy(Stream):
+    """
+    Copies or moves files and folders into `destination`, `copied` of `size` bytes and
+    `done` of `total` entries, with the rate in bytes/s and the ETA in seconds
+
+    Folders are copied in parallel with `walk_parallel`, the files of a folder are copied
+    in batches so many small files are spread over the workers. File data is copied by the
+    kernel when possible (copy_file_range, then sendfile) and with a buffer otherwise
+
+    `conflict` is what to do when a copied path already exists in `destination`:
+    'rename' copies it as 'name (1)', 'skip' leaves it, 'overwrite' replaces the files
+    (and merges the folders) and 'error' counts it as an error
+
+    A move is a rename when on the same device, otherwise a copy and a delete
+
+    With `resume` the files already copied (same size and mtime) are skipped, `targets`
+    are then the targets resolved by the interrupted copy
+    """
+
+    BATCH_FILES = 64
+    BATCH_BYTES = 64 << 20
+    CHUNK = 8 << 20
+
+    def __init__(
+        self,
+        id: str,
+        paths: str | list[str],
+        destination: str,
+        move=False,
+        conflict: Literal['rename', 'skip', 'overwrite', 'error'] = 'rename',
+        workers=8,
+        targets: dict[str, str] | None = None,
+        resume=False,
+    ):
+        super().__init__()
+        self.id = id
+        self.paths = [paths] if isinstance(paths, str) else paths
+        self.destination = destination
+        self.move = move
+        self.conflict = conflict
+        self.workers = workers
+        self.targets = targets
+        self.resume = resume
+        self.total = 0
+        self.done = 0
+        self.size = 0
+        self.copied = 0
+        self.errors = 0
+        self.started = 0.0
+        self.last_copied = None
+        self.lock = Lock()
+
+    def start(self):
+        self.thread = Thread(target=self.copy)
+        self.thread.start()
+
+    def resolve_targets(self):
+        """Where each path is copied to, the paths that are not copied are left out"""
+
+        targets = {}
+
+        for path in self.paths:
+            target = self.resolve(path)
+
+            if target is not None:
+                targets[path] = target
+
+        return targets
+
+    def copy(self):
+        try:
+            self.started = time()
+            jobs = []
+
+            if self.targets is None:
+                self.targets = self.resolve_targets()
+
+            for path, target in self.targets.items():
+                if self.cancelled:
+                    break
+
+                # Already moved before a resume
+                if not os.path.lexists(path):
+                    continue
+
+                if self.move and self.rename(path, target):
+                    continue
+
+                entries, size = get_tree_size(path, self.workers, self.token)
+
+                with self.lock:
+                    self.total += entries
+                    self.size += size
+
+                jobs.append((path, target, entries))
+
+            for path, target, entries in jobs:
+                if self.cancelled:
+                    break
+
+                errors = self.errors
+                done = self.done
+                self.copy_tree(path, target)
+
+                # The source is deleted only if everything was copied
+                copied = errors == self.errors and self.done - done == entries
+
+                if self.move and not self.cancelled and copied:
+                    remove = StreamDelete(self.id, path, False, self.workers)
+                    remove.token = self.token
+                    remove.remove()
+        finally:
+            self.finish()
+
+    def resolve(self, path: str) -> str | None:
+        """Where `path` is copied to, None if it is not copied"""
+
+        target = os.path.join(
+            self.destination, os.path.basename(os.path.normpath(path))
+        )
+
+        # A move into its own folder leaves it where it is
+        if os.path.abspath(target) == os.path.abspath(path) and (
+            self.move or self.conflict != 'rename'
+        ):
+            return None
+
+        destination = os.path.join(os.path.abspath(self.destination), '')
+
+        if destination.startswith(os.path.join(os.path.abspath(path), '')):
+            self.fail(f"Can't copy {path} into itself")
+            return None
+
+        if not os.path.lexists(target):
+            return target
+
+        if self.conflict == 'rename':
+            return get_free_name(target)
+
+        if self.conflict == 'overwrite':
+            return target
+
+        if self.conflict == 'error':
+            self.fail(f'{target} already exists')
+
+        return None
+
+    def rename(self, path: str, target: str):
+        """Moves with a rename, False if it must be copied (e.g. other device)"""
+
+        # A folder is merged into an existing one by copying
+        if os.path.isdir(target) and not os.path.islink(target):
+            return False
+
+        try:
+            os.replace(path, target)
+        except OSError:
+            return False
+
+        # Counted as one entry, walking it only for the progress would be slower than the move
+        with self.lock:
+            self.total += 1
+            self.done += 1
+
+        self.last_copied = Path(target).as_posix()
+
+        return True
+
+    def copy_tree(self, path: str, target: str):
+        if os.path.isdir(path) and not os.path.islink(path):
+            scan = io_scheduler.wrap(self.scan, IOScheduler.BULK, path)
+            walk_parallel([('folder', path, target)], scan, self.workers, self.token)
+        elif os.path.islink(path) or os.path.isfile(path):
+            with io_scheduler.slot(IOScheduler.BULK, io_scheduler.get_device(path)):
+                self.copy_files([(path, target)])
+        else:
+            self.fail(f'{path} is not a regular file')
+
+    def scan(self, job: tuple):
+        if job[0] == 'files':
+            self.copy_files(job[1])
+            return []
+
+        _, folder, target = job
+
+        jobs = []
+        batch = []
+        batch_size = 0
+
+        # walk_parallel ignores OSError, it must count as a failed copy
+        try:
+            os.makedirs(target, exist_ok=True)
+            self.progress(1, 0, target)
+
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    with suppress(FileNotFoundError):
+                        dst = os.path.join(target, entry.name)
+
+                        if entry.is_dir(follow_symlinks=False):
+                            jobs.append(('folder', entry.path, dst))
+                            continue
+
+                        # Opening a FIFO would block the worker, the special files
+                        # are errors like in shutil.copytree
+                        regular = entry.is_file(follow_symlinks=False)
+
+                        if not regular and not entry.is_symlink():
+                            self.fail(f'{entry.path} is not a regular file')
+                            continue
+
+                        batch.append((entry.path, dst))
+                        batch_size += entry.stat(follow_symlinks=False).st_size
+
+                        if (
+                            len(batch) >= self.BATCH_FILES
+                            or batch_size >= self.BATCH_BYTES
+                        ):
+                            jobs.append(('files', batch))
+                            batch = []
+                            batch_size = 0
+        except OSError as e:
+            self.fail(str(e))
+            return []
+
+        if batch:
+            jobs.append(('files', batch))
+
+        return jobs
+
+    def copy_files(self, files: list[tuple[str, str]]):
+        for src, dst in files:
+            if self.cancelled:
+                return
+
+            try:
+                if os.path.islink(src):
+                    if os.path.lexists(dst):
+                        os.unlink(dst)
+
+                    os.symlink(os.readlink(src), dst)
+                    self.progress(1, 0, dst)
+                else:
+                    self.copy_file(src, dst)
+            except OSError as e:
+                self.fail(str(e))
+
+    def copy_file(self, src: str, dst: str):
+        if self.resume and self.is_copied(src, dst):
+            return
+
+        # Overwrite the link, not what it points to
+        if os.path.islink(dst):
+            os.unlink(dst)
+
+        with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb', buffering=0) as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+
+            try:
+                copied = self.copy_data(fsrc.fileno(), fdst.fileno(), size)
+
+                if copied != size and not self.cancelled:
+                    raise OSError(f'Copied {copied} of {size} bytes of {src}')
+            except BaseException:
+                fdst.close()
+
+                with suppress(OSError):
+                    os.unlink(dst)
+                raise
+
+        if self.cancelled:
+            with suppress(OSError):
+                os.unlink(dst)
+            return
+
+        copystat(src, dst)
+        self.progress(1, 0, dst)
+
+    def is_copied(self, src: str, dst: str):
+        try:
+            a = os.stat(src)
+            b = os.stat(dst, follow_symlinks=False)
+        except OSError:
+            return False
+
+        # The mtime is copied last, a partial copy has a newer one
+        if (a.st_size, a.st_mtime_ns) != (b.st_size, b.st_mtime_ns):
+            return False
+
+        self.progress(1, a.st_size, dst)
+
+        return True
+
+    def copy_data(self, fsrc: int, fdst: int, size: int):
+        """Copies `size` bytes, returns the bytes copied (fewer if cancelled or truncated)"""
+
+        offset = 0
+
+        for copy in (self.copy_file_range, self.sendfile, self.copy_buffered):
+            try:
+                while offset < size:
+                    if self.cancelled:
+                        return offset
+
+                    n = copy(fsrc, fdst, offset)
+
+                    if not n:
+                        break
+
+                    offset += n
+                    self.progress(0, n)
+
+                return offset
+            except (AttributeError, OSError) as e:
+                # Not supported for these files (or platform), the next method continues
+                if (
+                    offset
+                    or isinstance(e, OSError)
+                    and e.errno
+                    not in (
+                        errno.EXDEV,
+                        errno.ENOSYS,
+                        errno.EINVAL,
+                        errno.EOPNOTSUPP,
+                        errno.ENOTSUP,
+                        errno.EBADF,
+                        errno.ENOTSOCK,
+                    )
+                ):
+                    raise
+
+        raise OSError(errno.ENOTSUP, 'No method to copy the file data')
+
+    def copy_file_range(self, fsrc: int, fdst: int, offset: int):
+        return os.copy_file_range(fsrc, fdst, self.CHUNK, offset, offset)
+
+    def sendfile(self, fsrc: int, fdst: int, offset: int):
+        return os.sendfile(fdst, fsrc, offset, self.CHUNK)
+
+    def copy_buffered(self, fsrc: int, fdst: int, offset: int):
+        # os.pread and os.pwrite don't exist on Windows
+        os.lseek(fsrc, offset, os.SEEK_SET)
+        os.lseek(fdst, offset, os.SEEK_SET)
+        data = os.read(fsrc, 1 << 20)
+        view = memoryview(data)
+
+        while view:
+            view = view[os.write(fdst, view) :]
+
+        return len(data)
+
+    def progress(self, entries: int, size: int, path: str | None = None):
+        io_scheduler.throttle(IOScheduler.BULK, size)
+
+        with self.lock:
+            self.done += entries
+            self.copied += size
+
+        if path is not None:
+            self.last_copied = Path(path).as_posix()
+
+    def fail(self, error: str):
+        print(error)
+
+        with self.lock:
+            self.errors += 1
+
+    def status(self):
+        elapsed = time() - self.started if self.started else 0
+        rate = self.copied / elapsed if elapsed else 0
+
+        return {
+            'total': self.total,
+            'done': self.done,
+            'size': self.size,
+            'copied': self.copied,
+            'errors': self.errors,
+            'rate': rate,
+            'eta': (self.size - self.copied) / rate if rate else None,
+        }
+
+
+class JobQueue:
+    """
+    File operations (delete and copy) run `concurrency` at a time and journaled in a
+    sqlite database, the jobs not finished when the app closed are resumed on start
+
+    A job's stream is registered in `streams` as soon as it is queued, so its progress is
+    polled with `stream_delete`/`stream_copy` and it is cancelled with `cancel_stream`
+    """
+
+    FINISHED = ('done', 'cancelled', 'failed')
+
+    def __init__(
+        self, path: Path, streams: dict[str, dict], concurrency=2, workers=8, keep=100
+    ):
+        self.path = path
+        self.streams = streams
+        self.concurrency = concurrency
+        self.workers = workers
+        self.keep = keep
+        self.queue = deque()
+        self.jobs = {}
+        self.cond = Condition()
+
+        with self.connect() as db:
+            db.executescript("""
+                PRAGMA journal_mode = WAL;
+
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    args TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    status TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                );
+                """)
+
+    @contextmanager
+    def connect(self):
+        """Committed, or rolled back on errors, and closed when the block exits"""
+
+        db = sqlite3.connect(self.path, check_same_thread=False)
+
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def start(self):
+        with self.connect() as db:
+            pending = db.execute(
+                "SELECT id, kind, args FROM jobs WHERE state IN ('queued', 'running') "
+                'ORDER BY created'
+            ).fetchall()
+
+        for _ in range(self.concurrency):
+            Thread(target=self.worker, daemon=True).start()
+
+        for id, kind, args in pending:
+            # Submitted before the start
+            if id in self.jobs:
+                continue
+
+            try:
+                self.enqueue(id, kind, loads(args), resume=True)
+            except Exception as e:
+                # A journal row that can't be resumed must not stop the others
+                print_exc()
+                self.update(id, 'failed', {'error': repr(e)})
+
+    def submit(self, kind: Literal['delete', 'copy'], id: str, args: dict):
+        now = time()
+
+        # Held until enqueued, the same id can't be submitted twice meanwhile
+        with self.cond:
+            # Its row and stream would be replaced under the worker running it
+            if id in self.jobs:
+                raise ValueError(f'Job {id} is already queued or running')
+
+            with self.connect() as db:
+                db.execute(
+                    'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, NULL, ?, ?)',
+                    (id, kind, dumps(args), 'queued', now, now),
+                )
+
+            self.enqueue(id, kind, args)
+
+    def enqueue(self, id: str, kind: str, args: dict, resume=False):
+        if kind == 'delete':
+            stream = StreamDelete(id, args['paths'], args['moveToTrash'], self.workers)
+        else:
+            stream = StreamCopy(
+                id,
+                args['paths'],
+                args['destination'],
+                args['move'],
+                args['conflict'],
+                self.workers,
+                args.get('targets'),
+                resume,
+            )
+
+        with streams_lock:
+            self.streams[kind][id] = stream
+
+        with self.cond:
+            self.jobs[id] = (kind, args, stream)
+            self.queue.append(id)
+            self.cond.notify()
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+
+                id = self.queue.popleft()
+                kind, args, stream = self.jobs[id]
+
+            status = None
+
+            try:
+                self.run(id, kind, args, stream)
+            except Exception as e:
+                # Journaled as failed, so it isn't resumed (and raising again) on every start
+                print_exc()
+                status = {**stream.status(), 'error': repr(e)}
+                stream.finish()
+
+            if status is not None:
+                state = 'failed'
+            elif stream.cancelled:
+                state = 'cancelled'
+            elif stream.errors:
+                state = 'failed'
+            else:
+                state = 'done'
+
+            self.update(id, state, status or stream.status())
+
+            with self.cond:
+                del self.jobs[id]
+
+    def run(self, id: str, kind: str, args: dict, stream: 'StreamDelete | StreamCopy'):
+        if stream.cancelled:
+            stream.finish()
+        elif kind == 'delete':
+            self.update(id, 'running')
+            stream.delete()
+        else:
+            # The targets are journaled so a resumed copy continues into them
+            if stream.targets is None:
+                stream.targets = stream.resolve_targets()
+                self.update(id, 'running', args={**args, 'targets': stream.targets})
+            else:
+                self.update(id, 'running')
+
+            stream.copy()
+
+    def update(
+        self, id: str, state: str, status: dict | None = None, args: dict | None = None
+    ):
+        try:
+            self.write(id, state, status, args)
+        except sqlite3.Error:
+            # The job still runs, only its journal entry is behind
+            print_exc()
+
+    def write(self, id: str, state: str, status: dict | None, args: dict | None):
+        with self.connect() as db:
+            db.execute(
+                'UPDATE jobs SET state = ?, status = coalesce(?, status), '
+                'args = coalesce(?, args), updated = ? WHERE id = ?',
+                (
+                    state,
+                    None if status is None else dumps(status),
+                    None if args is None else dumps(args),
+                    time(),
+                    id,
+                ),
+            )
+
+            if state in self.FINISHED:
+                db.execute(
+                    """
+                    DELETE FROM jobs WHERE id IN (
+                        SELECT id FROM jobs WHERE state IN ('done', 'cancelled', 'failed')
+                        ORDER BY updated DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.keep,),
+                )
+
+    def get(self, id: str):
+        with self.connect() as db:
+            row = db.execute(
+                'SELECT id, kind, args, state, status, created, updated FROM jobs WHERE id = ?',
+                (id,),
+            ).fetchone()
+
+        return None if row is None else self.to_job(row)
+
+    def list(self):
+        with self.connect() as db:
+            rows = db.execute(
+                'SELECT id, kind, args, state, status, created, updated FROM jobs '
+                'ORDER BY created DESC'
+            ).fetchall()
+
+        return [self.to_job(i) for i in rows]
+
+    def to_job(self, row: tuple):
+        id, kind, args, state, status, created, updated = row
+
+        with self.cond:
+            job = self.jobs.get(id)
+
+        # The live progress of the jobs not finished
+        if job is not None and state not in self.FINISHED:
+            status = job[2].status()
+        else:
+            status = loads(status) if status else None
+
+        try:
+            args = loads(args)
+        except ValueError:
+            # A malformed row is listed (as failed) rather than breaking the list
+            args = None
+
+        return {
+            'id': id,
+            'kind': kind,
+            'args': args,
+            'state': state,
+            'status': status,
+            'created': created,
+            'updated': updated,
+        }
+
+
+def get_glob_literals(pattern: str):
+    """Substrings that every name matching the glob `pattern` contains"""
+
+    literals = []
+    literal = ''
+    in_class = False
+
+    for char in pattern:
+        if in_class:
+            in_class = char != ']'
+        elif char in '*?[/':
+            literals.append(literal)
+            literal = ''
+            in_class = char == '['
+        else:
+            literal += char
+
+    return [i for i in [*literals, literal] if i]
+
+
+# The digits after an escape letter, other arguments are in {} or <>
+ESCAPE_ARGUMENTS = {
+    'x': r'[\da-fA-F]{0,2}',
+    'u': r'[\da-fA-F]{0,4}',
+    'U': r'[\da-fA-F]{0,8}',
+    **{i: r'\d{0,2}' for i in '0123456789'},
+}
+
+
+def get_regex_literals(pattern: str, flags: str = ''):
+    """
+    Substrings that every name matching the regex `pattern` contains, conservative:
+    groups, classes and escapes end a literal, alternations and verbose mode give none
+    """
+    # Verbose mode from the flags or inline, e.g. (?x) or (?ix:...)
+    if 'x' in flags or re.search(r'\(\?[a-zA-Z-]*x[a-zA-Z-]*[:)]', pattern):
+        return []
+
+    literals = []
+    literal = ''
+    depth = 0
+    i = 0
+
+    while i < len(pattern):
+        char = pattern[i]
+
+        if char == '\\':
+            escaped = pattern[i + 1 : i + 2]
+            i += 2
+
+            if escaped.isalnum():
+                # The argument isn't literal text, e.g. \x41, \101, \p{Lu} or \g<name>
+                argument = re.match(
+                    r'\{[^}]*\}|<[^>]*>|' + ESCAPE_ARGUMENTS.get(escaped[0], ''),
+                    pattern[i:],
+                )
+                i += len(argument.group())
+
+            if depth or not escaped or escaped.isalnum():
+                literals.append(literal)
+                literal = ''
+            else:
+                literal += escaped
+
+            continue
+
+        if char == '[':
+            # Skip the class, ']' right after '[' or '[^' is part of it
+            literals.append(literal)
+            literal = ''
+            i += 1
+            if pattern[i : i + 1] == '^':
+                i += 1
+            if pattern[i : i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+            continue
+
+        if char == '|' and not depth:
+            return []
+
+        if char == '(':
+            depth += 1
+            literals.append(literal)
+            literal = ''
+        elif char == ')':
+            depth = max(0, depth - 1)
+        elif depth:
+            ...
+        elif char == '{' and re.match(r'\{\d*,?\d*\}', pattern[i:]):
+            quantifier = re.match(r'\{\d*,?\d*\}', pattern[i:]).group()
+
+            # {0}, {0,n} and {,n} make the last character optional
+            if quantifier[1] in '0,':
+                literal = literal[:-1]
+
+            literals.append(literal)
+            literal = ''
+            i += len(quantifier)
+            continue
+        elif char in '*?':
+            # The last character is optional
+            literals.append(literal[:-1])
+            literal = ''
+        elif char in '+.^$':
+            literals.append(literal)
+            literal = ''
+        else:
+            literal += char
+
+        i += 1
+
+    return [i for i in [*literals, literal] if i]
+
+
+class FileIndex:
+    """
+    Names of the files and folders under the configured roots, in a sqlite database
+
+    A refresh stats every indexed folder and only lists again the folders whose mtime
+    changed, the index survives restarts and is usable while refreshing
+    """
+
+    FOLDER = 1
+    FILE = 0
+
+    def __init__(self, path: Path, roots: list[str], refresh_interval=300, workers=8):
+        self.path = path
+        self.roots = [Path(i).as_posix() for i in roots]
+        self.refresh_interval = refresh_interval
+        self.workers = workers
+        self.lock = Lock()
+
+        with self.connect() as db:
+            db.executescript("""
+                PRAGMA journal_mode = WAL;
+
+                CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY);
+                CREATE TABLE IF NOT EXISTS folders (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    mtime INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS entries (
+                    folder INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    kind INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_folder ON entries (folder);
+                """)
+
+            self.trigrams = self.create_trigrams(db)
+
+    def create_trigrams(self, db: sqlite3.Connection):
+        """
+        Trigram posting lists of the names (fts5 trigram tokenizer, sqlite >= 3.34), kept in
+        sync with `entries` by triggers. Returns False if sqlite can't create it
+        """
+        exists = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'trigrams'"
+        ).fetchone()
+
+        if exists:
+            return True
+
+        try:
+            db.executescript("""
+                CREATE VIRTUAL TABLE trigrams USING fts5 (
+                    name, content = 'entries', content_rowid = 'rowid', tokenize = 'trigram'
+                );
+
+                CREATE TRIGGER entries_insert AFTER INSERT ON entries BEGIN
+                    INSERT INTO trigrams (rowid, name) VALUES (new.rowid, new.name);
+                END;
+                CREATE TRIGGER entries_delete AFTER DELETE ON entries BEGIN
+                    INSERT INTO trigrams (trigrams, rowid, name)
+                    VALUES ('delete', old.rowid, old.name);
+                END;
+
+                -- Names indexed before the trigrams existed
+                INSERT INTO trigrams (trigrams) VALUES ('rebuild');
+                """)
+        except sqlite3.OperationalError:
+            return False
+
+        return True
+
+    @contextmanager
+    def connect(self):
+        """Committed, or rolled back on errors, and closed when the block exits"""
+
+        db = sqlite3.connect(self.path, check_same_thread=False)
+
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def start(self):
+        if self.roots:
+            Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            for root in self.roots:
+                try:
+                    self.refresh(root)
+                except Exception:
+                    print_exc()
+
+            sleep(self.refresh_interval)
+
+    def covers(self, path: Path):
+        """If the index can answer searches in `path`, the root must have been indexed once"""
+
+        path = path.as_posix()
+
+        with self.connect() as db:
+            return any(
+                path == root or path.startswith(f'{root.rstrip("/")}/')
+                for (root,) in db.execute('SELECT path FROM roots')
+                if root in self.roots
+            )
+
+    def refresh(self, root: str):
+        seen = set()
+
+        def scan(folder: str):
+            stat = os.stat(folder)
+
+            with self.lock:
+                row = db.execute(
+                    'SELECT id, mtime FROM folders WHERE path = ?', (folder,)
+                ).fetchone()
+
+                if row and row[1] == stat.st_mtime_ns:
+                    seen.add(row[0])
+
+                    return [
+                        f'{folder.rstrip("/")}/{name}'
+                        for (name,) in db.execute(
+                            'SELECT name FROM entries WHERE folder = ? AND kind = ?',
+                            (row[0], self.FOLDER),
+                        )
+                    ]
+
+            entries = []
+
+            with os.scandir(folder) as it:
+                for entry in it:
+                    with suppress(OSError):
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        entries.append(
+                            (entry.name, self.FOLDER if is_dir else self.FILE)
+                        )
+
+            with self.lock:
+                id = db.execute(
+                    """
+                    INSERT INTO folders (path, mtime) VALUES (?, ?)
+                    ON CONFLICT (path) DO UPDATE SET mtime = excluded.mtime
+                    RETURNING id
+                    """,
+                    (folder, stat.st_mtime_ns),
+                ).fetchone()[0]
+                seen.add(id)
+
+                db.execute('DELETE FROM entries WHERE folder = ?', (id,))
+                db.executemany(
+                    'INSERT INTO entries (folder, name, kind) VALUES (?, ?, ?)',
+                    ((id, name, kind) for name, kind in entries),
+                )
+
+            return [
+                f'{folder.rstrip("/")}/{name}'
+                for name, kind in entries
+                if kind == self.FOLDER
+            ]
+
+        with self.connect() as db:
+            walk_parallel(
+                [root], io_scheduler.wrap(scan, IOScheduler.SIZE, root), self.workers
+            )
+
+            with self.lock:
+                # Folders deleted since the last refresh
+                gone = [
+                    id
+                    for (id,) in db.execute(
+                        'SELECT id FROM folders WHERE path = ? OR (path >= ? AND path < ?)',
+                        self.subtree(root),
+                    )
+                    if id not in seen
+                ]
+
+                db.executemany(
+                    'DELETE FROM entries WHERE folder = ?', ((i,) for i in gone)
+                )
+                db.executemany('DELETE FROM folders WHERE id = ?', ((i,) for i in gone))
+                db.execute('INSERT OR IGNORE INTO roots (path) VALUES (?)', (root,))
+
+    def subtree(self, path: str):
+        # All the paths starting with `path/`, '0' is the character after '/'
+        prefix = f'{path.rstrip("/")}/'
+
+        return path, prefix, f'{prefix[:-1]}0'
+
+    def search(self, path: Path, matches, literals: list[str] | None = None):
+        """
+        Paths of the entries under `path` whose name `matches`
+
+        `literals` are substrings every matching name contains (case insensitive), the
+        ones with 3+ characters select the candidates from the trigrams before `matches`
+        runs, without literals all the names under `path` are checked
+        """
+        literals = [i for i in literals or [] if len(i) >= 3]
+
+        with self.connect() as db:
+            db.create_function(
+                'matches', 1, lambda name: bool(matches(name)), deterministic=True
+            )
+
+            if literals and self.trigrams:
+                query = ' AND '.join(
+                    '"{}"'.format(i.replace('"', '""')) for i in literals
+                )
+
+                rows = db.execute(
+                    """
+                    SELECT folders.path, entries.name FROM trigrams
+                    JOIN entries ON entries.rowid = trigrams.rowid
+                    JOIN folders ON folders.id = entries.folder
+                    WHERE trigrams MATCH ?
+                    AND (folders.path = ? OR (folders.path >= ? AND folders.path < ?))
+                    AND matches(entries.name)
+                    """,
+                    (query, *self.subtree(path.as_posix())),
+                )
+            else:
+                rows = db.execute(
+                    """
+                    SELECT folders.path, entries.name FROM entries
+                    JOIN folders ON folders.id = entries.folder
+                    WHERE (folders.path = ? OR (folders.path >= ? AND folders.path < ?))
+                    AND matches(entries.name)
+                    """,
+                    self.subtree(path.as_posix()),
+                )
+
+            for folder, name in rows:
+                yield f'{folder.rstrip("/")}/{name}'
+
+    def status(self):
+        with self.connect() as db:
+            return {
+                'roots': self.roots,
+                'indexed': [i for (i,) in db.execute('SELECT path FROM roots')],
+                'folders': db.execute('SELECT COUNT(*) FROM folders').fetchone()[0],
+                'entries': db.execute('SELECT COUNT(*) FROM entries').fetchone()[0],
+            }
+
+
+class StreamFind(Stream):
+    def __init__(self, path: str, query: str, workers=8):
+        super().__init__()
+        self.path = Path(path)
+        self.query = query
+        self.workers = workers
+        self.total = 0
+        self.total_lock = Lock()
+        self.started = time()
+        self.ended = None
+        self.regex = self.create_regex(query)
+        self.literals = self.get_literals(query)
+
+    def start(self):
+        self.thread = Thread(target=self.find)
+        self.thread.start()
+
+    def get_literals(self, search: str):
+        is_regex = re.search(r'\/(?<regex>.+)\/(?<flags>.*)', search)
+
+        if is_regex:
+            return get_regex_literals(is_regex.group('regex'), is_regex.group('flags'))
+
+        # Names containing the whole text contain all the glob literals too
+        return get_glob_literals(search)
+
+    def create_regex(self, search: str):
+        flags = {
+            'i': re.I,
+            'm': re.M,
+            's': re.S,
+            'x': re.X,
+            'a': re.A,
+            'u': re.U,
+            'l': re.L,
+        }
+        is_regex = re.search(r'\/(?<regex>.+)\/(?<flags>.*)', search)
+
+        if is_regex:
+            parsed_flags = 0
+
+            for i in is_regex.group('flags'):
+                parsed_flags |= flags.get(i, 0)
+
+            return re.compile(is_regex.group('regex'), parsed_flags)
+
+        return re.compile(re.escape(search), re.I)
+
+    def matches(self, name: str):
+        return self.regex.search(name) or PurePath(name).match(self.query)
+
+    def find(self):
+        try:
+            if file_index.covers(self.path):
+                self.find_in_index()
+            else:
+                self.find_in_disk()
+        finally:
+            self.finish()
+
+    def find_in_index(self):
+        for path in file_index.search(self.path, self.matches, self.literals):
+            if self.cancelled:
+                break
+
+            # The index can be behind the disk
+            with suppress(FileNotFoundError):
+                self.push(get_path_entry(path))
+                self.total += 1
+
+    def find_in_disk(self):
+        scan = io_scheduler.wrap(self.scan, IOScheduler.SEARCH, self.path)
+        walk_parallel([self.path], scan, self.workers, self.token)
+
+    def scan(self, folder: Path):
+        folders = []
+        matches = []
+        parent = folder.as_posix()
+        scanned = 0
+
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if self.cancelled:
+                    break
+
+                scanned += 1
+
+                with suppress(OSError):
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(Path(entry.path))
+
+                    if self.matches(entry.name):
+                        matches.append(get_entry(entry, parent))
+
+        # One batch per folder
+        with self.total_lock:
+            self.total += scanned
+
+        if matches:
+            self.extend(matches)
+
+        return folders
+
+    def finish(self):
+        self.ended = time()
+        super().finish()
+
+    def status(self):
+        elapsed = (self.ended or time()) - self.started
+
+        return {'total': self.total, 'rate': round(self.total / max(elapsed, 0.001))}
+
+    def __eq__(self, other):
+        return self.path == other.path
+
+
+class StreamLs(Stream):
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = Path(path)
+        self.total = 0
+
+    def start(self):
+        self.thread = Thread(target=self.ls)
+        self.thread.start()
+
+    def ls(self):
+        try:
+            cached = ls_cache.get(self.path)
+
+            if cached is not None:
+                for item in cached:
+                    self.push(item)
+                    self.total += 1
+
+                return
+
+            stat = os.stat(self.path)
+            items = []
+
+            with io_scheduler.slot(IOScheduler.INTERACTIVE, stat.st_dev):
+                for item in scan_dir(self.path):
+                    if self.cancelled:
+                        return
+
+                    items.append(item)
+                    self.push(item)
+                    self.total += 1
+
+            ls_cache.set(self.path, stat, items)
+        finally:
+            self.finish()
+
+    def __eq__(self, other):
+        return self.path == other.path
+
+
+class InotifyWatcher:
+    """Changed entries of a folder, using inotify (linux only)"""
+
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    EVENT = struct.Struct('iIII')
+
+    # Returned with the names when events were lost, no file name contains a NUL
+    RESCAN = '\0'
+
+    libc = None
+
+    @classmethod
+    def available(cls):
+        if not sys.platform.startswith('linux'):
+            return False
+
+        if cls.libc is None:
+            cls.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+        return hasattr(cls.libc, 'inotify_init1')
+
+    def __init__(self, path: Path):
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        mask = (
+            self.IN_MODIFY
+            | self.IN_ATTRIB
+            | self.IN_MOVED_FROM
+            | self.IN_MOVED_TO
+            | self.IN_CREATE
+            | self.IN_DELETE
+            | self.IN_DELETE_SELF
+            | self.IN_MOVE_SELF
+        )
+
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {path}')
+
+    def wait(self, timeout: float) -> set[str] | None:
+        """Names changed until `timeout`, None if the folder itself was deleted or moved"""
+
+        if not select([self.fd], [], [], timeout)[0]:
+            return set()
+
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+
+        names = set()
+        offset = 0
+
+        while offset < len(data):
+            _, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF | self.IN_IGNORED):
+                return None
+
+            name = os.fsdecode(data[offset : offset + length].rstrip(b'\0'))
+            offset += length
+
+            # The queue overflowed, the changed names are unknown
+            if mask & self.IN_Q_OVERFLOW:
+                names.add(self.RESCAN)
+
+            # Events without a name are about the folder itself
+            elif name:
+                names.add(name)
+
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Changed entries of a folder, comparing a snapshot of the folder every `interval` seconds"""
+
+    def __init__(self, path: Path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.last_poll = time()
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        snapshot = {}
+
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                with suppress(FileNotFoundError):
+                    stat = entry.stat(follow_symlinks=False)
+                    snapshot[entry.name] = (
+                        stat.st_mtime_ns,
+                        stat.st_size,
+                        stat.st_mode,
+                    )
+
+        return snapshot
+
+    def wait(self, timeout: float) -> set[str] | None:
+        sleep(min(timeout, max(0, self.last_poll + self.interval - time())))
+
+        if time() - self.last_poll < self.interval:
+            return set()
+
+        self.last_poll = time()
+
+        try:
+            snapshot = self.take_snapshot()
+        except FileNotFoundError:
+            return None
+
+        names = {
+            name
+            for name in snapshot.keys() | self.snapshot.keys()
+            if snapshot.get(name) != self.snapshot.get(name)
+        }
+        self.snapshot = snapshot
+
+        return names
+
+    def close(self): ...
+
+
+class StreamWatch(Stream):
+    """
+    Pushes the changes of a folder as deltas, `{'event': 'added' | 'removed' | 'modified',
+    'path': str, 'item': ExplorerItem | None}`
+
+    Bursts of events (e.g. deleting thousands of files) are coalesced, the deltas are sent
+    after `delay` seconds without events, or at most every `max_delay` seconds
+    """
+
+    def __init__(self, path: str, delay=0.1, max_delay=1.0):
+        super().__init__()
+        self.path = Path(path)
+        self.delay = delay
+        self.max_delay = max_delay
+        self.total = 0
+
+    def start(self):
+        self.thread = Thread(target=self.watch, daemon=True)
+        self.thread.start()
+
+    # The watch lives while someone is subscribed to it
+    def unsubscribe(self, listener):
+        super().unsubscribe(listener)
+
+        if not self.listeners:
+            self.cancel()
+
+    def watch(self):
+        watcher = None
+
+        try:
+            if InotifyWatcher.available():
+                watcher = InotifyWatcher(self.path)
+            else:
+                watcher = PollingWatcher(self.path)
+
+            known = self.list_names()
+
+            while not self.cancelled:
+                names = watcher.wait(0.5)
+
+                if not names:
+                    if names is None:
+                        break
+                    continue
+
+                first = time()
+                more = set()
+
+                while time() - first < self.max_delay:
+                    more = watcher.wait(self.delay)
+
+                    if not more:
+                        break
+
+                    names |= more
+
+                if InotifyWatcher.RESCAN in names:
+                    names.discard(InotifyWatcher.RESCAN)
+                    names |= known | self.list_names()
+
+                # Files changed without changing the folder mtime
+                ls_cache.invalidate(self.path)
+                listings.pop(self.path.as_posix())
+
+                deltas = self.diff(names, known)
+                self.total += len(deltas)
+                self.extend(deltas)
+
+                if more is None:
+                    break
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+            self.finish()
+
+    def list_names(self):
+        with os.scandir(self.path) as entries:
+            return {i.name for i in entries}
+
+    def diff(self, names: set[str], known: set[str]):
+        deltas = []
+        parent = self.path.as_posix()
+
+        for name in names:
+            path = (self.path / name).as_posix()
+
+            try:
+                # Broken symlinks are listed too, see `get_entry`
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    stat = os.lstat(path)
+            except FileNotFoundError:
+                if name in known:
+                    known.discard(name)
+                    deltas.append({'event': 'removed', 'path': path, 'item': None})
+                continue
+            except OSError:
+                # Not readable now, it stays as it was listed
+                continue
+
+            item = Entry(name, parent, stat).to_item()
+
+            deltas.append(
+                {
+                    'event': 'modified' if name in known else 'added',
+                    'path': path,
+                    'item': item,
+                }
+            )
+            known.add(name)
+
+        return deltas
+
+    def __eq__(self, other):
+        return self.path == other.path
+
+
+class API:
+    def close(self):
+        w.destroy()
+
+    def minimize(self):
+        w.minimize()
+
+    def maximize(self):
+        w.toggle_fullscreen()
+
+    def get_path_info(self, path: str):
+        return get_path_info(path)
+
+    def start_ls(self, folder: str):
+        # A new listing of the same folder supersedes the old one
+        start_stream(streams_ls, folder, StreamLs(folder))
+
+    def start_find(self, path: str, query: str):
+        # A new search in the same folder supersedes the old one
+        start_stream(
+            streams_finds,
+            path,
+            StreamFind(path, query, get_config_value('find', 'workers', 8)),
+        )
+
+    # Used by websocket subscriptions, the items are pushed instead of polled
+    # The streams stay in their dict until replaced, so they can still be cancelled
+    def subscribe_ls(self, folder: str):
+        return start_stream(streams_ls, folder, StreamLs(folder))
+
+    def subscribe_find(self, path: str, query: str):
+        return start_stream(
+            streams_finds,
+            path,
+            StreamFind(path, query, get_config_value('find', 'workers', 8)),
+        )
+
+    def file_type_cache_stats(self):
+        return file_type_cache.stats()
+
+    def index_status(self):
+        return file_index.status()
+
+    def subscribe_watch(self, folder: str):
+        s = StreamWatch(folder)
+        s.start()
+
+        return s
+
+    def start_folder_size(self, path: str):
+        start_stream(streams_files, path, StreamFolderSize(path))
+
+    def start_hash(self, path: str, algorithms: list[str] | None = None):
+        if algorithms is None:
+            algorithms = [*HASHES]
+
+        start_stream(streams_hashes, path, StreamHash(path, algorithms))
+
+    def start_duplicates(self, path: str):
+        start_stream(
+            streams_duplicates,
+            path,
+            StreamDuplicates(path, get_config_value('find', 'workers', 8)),
+        )
+
+    def subscribe_duplicates(self, path: str):
+        return start_stream(
+            streams_duplicates,
+            path,
+            StreamDuplicates(path, get_config_value('find', 'workers', 8)),
+        )
+
+    def start_copy(
+        self,
+        id: str,
+        paths: str | list[str],
+        destination: str,
+        move=False,
+        conflict: Literal['rename', 'skip', 'overwrite', 'error'] = 'rename',
+    ):
+        job_queue.submit(
+            'copy',
+            id,
+            {
+                'paths': [paths] if isinstance(paths, str) else paths,
+                'destination': destination,
+                'move': move,
+                'conflict': conflict,
+            },
+        )
+
+    def start_delete(self, id: str, path: str | list[str], moveToTrash=True):
+        job_queue.submit(
+            'delete',
+            id,
+            {
+                'paths': [path] if isinstance(path, str) else path,
+                'moveToTrash': moveToTrash,
+            },
+        )
+
+    def list_jobs(self):
+        return job_queue.list()
+
+    def get_job(self, id: str):
+        return job_queue.get(id)
+
+    def ls(self, folder: str):
+        s = streams_ls.get(folder)
+
+        if s is None:
+            return
+
+        # Read end before taking the items, so no item pushed before the end is lost
+        end = s.end
+        r = {'items': to_items(s.take()), 'end': end}
+
+        if end:
+            drop_stream(streams_ls, folder, s)
+
+        return r
+
+    def get_window(
+        self,
+        folder: str,
+        sort: str = 'name',
+        offset: int = 0,
+        limit: int = 100,
+        reverse=False,
+        filter: str = '',
+    ):
+        """Rows `offset` to `offset + limit` of the folder sorted by `sort`"""
+
+        return get_listing(folder).window(sort, offset, limit, reverse, filter)
+
+    def stream_folder_size(self, path: str | list[str]):
+        s = streams_files.get(path)
+
+        if s is None:
+            return
+
+        end = s.end
+        r = {'size': s.size, 'previous': s.previous, 'children': s.children, 'end': end}
+
+        if end:
+            drop_stream(streams_files, path, s)
+
+        return r
+
+    def stream_hash(self, path: str):
+        s = streams_hashes.get(path)
+
+        if s is None:
+            return
+
+        end = s.end
+        r = {**s.status(), 'digests': s.digests, 'end': end}
+
+        if end:
+            drop_stream(streams_hashes, path, s)
+
+        return r
+
+    def stream_duplicates(self, path: str):
+        s = streams_duplicates.get(path)
+
+        if s is None:
+            return
+
+        end = s.end
+        r = {'end': end, **s.status(), 'groups': s.take()}
+
+        if end:
+            drop_stream(streams_duplicates, path, s)
+
+        return r
+
+    def stream_copy(self, id: str):
+        s = streams_copies.get(id)
+
+        if s is None:
+            return
+
+        end = s.end
+        r = {'end': end, **s.status(), 'last_copied': s.last_copied}
+
+        if end:
+            drop_stream(streams_copies, id, s)
+
+        return r
+
+    def stream_delete(self, id: str):
+        s = streams_deletes.get(id)
+
+        if s is None:
+            return
+
+        end = s.end
+        r = {'end': end, **s.status(), 'last_deleted': s.last_deleted}
+
+        if end:
+            drop_stream(streams_deletes, id, s)
+
+        return r
+
+    def stream_find(self, path: str):
+        s = streams_finds.get(path)
+
+        if s is None:
+            return
+
+        end = s.end
+        r = {'end': end, **s.status(), 'files': to_items(s.take())}
+
+        if end:
+            drop_stream(streams_finds, path, s)
+
+        return r
+
+    def home(self):
+        return Path.home().as_posix()
+
+    def rename(self, path: str, name: str):
+        Path(path).rename(Path(path).parent / name)
+
+    def create_file(self, path: str):
+        Path(path).touch()
+
+    def create_folder(self, path: str):
+        Path(path).mkdir()
+
+    def exists(self, path: str):
+        return Path(path).exists()
+
+    def cancel_stream(self, id: str):
+        """Cancels a stream by its key, the folder/path for ls, find and folder size"""
+
+        for streams in (
+            streams_ls,
+            streams_finds,
+            streams_files,
+            streams_deletes,
+            streams_hashes,
+            streams_duplicates,
+            streams_copies,
+        ):
+            s = drop_stream(streams, id)
+
+            if s is not None:
+                s.cancel()
+
+    def delete_all_streams_ls(self):
+        cancel_streams(streams_ls)
+
+    def delete_all_streams_find(self):
+        cancel_streams(streams_finds)
+
+    def delete_all_streams_folder_size(self):
+        cancel_streams(streams_files)
+
+    def delete_all_streams_delete(self):
+        cancel_streams(streams_deletes)
+
+    def delete_all_streams_hash(self):
+        cancel_streams(streams_hashes)
+
+    def delete_all_streams_duplicates(self):
+        cancel_streams(streams_duplicates)
+
+    def delete_all_streams_copy(self):
+        cancel_streams(streams_copies)
+
+    def get_config(self):
+        return load_toml(CONFIG_FILE)
+
+    def set_config(self, config: dict):
+        CONFIG_FILE.write_text(dumps_toml(config))
+
+    def read(self, path: str):
+        try:
+            return Path(path).read_text('utf-8')
+        except UnicodeDecodeError:
+            return Path(path).read_text('iso-8859-1')
+
+    def read_b64(self, path: str):
+        return b64encode(Path(path).read_bytes()).decode()
+
+    def read_range(self, path: str, offset: int, length: int):
+        """
+        `length` bytes of the file from `offset`, at most `max_range_length`, sent raw on
+        binary connections and base64 encoded otherwise
+        """
+
+        if offset < 0 or length < 0:
+            raise ValueError(f'Invalid range: {offset}, {length}')
+
+        with open(path, 'rb', buffering=0) as f:
+            f.seek(offset)
+
+            return f.read(min(length, max_range_length))
+
+    def read_lines(self, path: str, start: int, count: int):
+        """
+        Lines `start` to `start + count` of a text file, `total` is the number of lines or
+        None if the file was not scanned up to its end yet
+        """
+
+        index = get_line_index(path)
+        line, offset = index.seek(start, count)
+        lines = []
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+
+            while line < start + count:
+                # Very long lines are cut, the rest of the line is skipped
+                data = f.readline(max_line_length)
+
+                if not data:
+                    break
+
+                if not data.endswith(b'\n'):
+                    while (rest := f.readline(max_line_length)) and not rest.endswith(
+                        b'\n'
+                    ):
+                        ...
+
+                if line >= start:
+                    lines.append(decode(data).rstrip('\r\n'))
+
+                line += 1
+
+        return {'lines': lines, 'total': index.total, 'size': index.stamp[0]}
+
+    def user(self):
+        return getuser()
+
+    def pwd(self):
+        return Path('').absolute().as_posix()
+
+    def setup_tests(self):
+        tests = Path('__tests')
+
+        if tests.exists():
+            rmtree(tests)
+
+        tests.mkdir()
+
+        for i in range(1000):
+            tests.joinpath(f'{i}').touch()
+
+        tests.joinpath('test.txt').touch()
+        tests.joinpath('foo.py').touch()
+        tests.joinpath('bar.py').touch()
+
+    def clear_tests(self):
+        rmtree('__tests')
+
+    def disks_info(self):
+        c = wmi.WMI()
+
+        disks: list[Disk] = []
+
+        for i in disk_partitions():
+            d = next(
+                d for d in c.Win32_LogicalDisk() if i.mountpoint.startswith(d.Caption)
+            )
+            usage = disk_usage(i.mountpoint)
+
+            disks.append(
                 {
                     'name': d.VolumeName or DRIVE_TYPES[d.DriveType],
                     'device': DRIVE_TYPES[d.DriveType],
@@ -2197,53 +5089,16 @@ class API:
         run(f'cd {folder} && fileclip.exe -v', shell=True)
 
     def get_crc32(self, path: str):
-        with open(path, 'rb') as f:
-            h = 0
-            while True:
-                data = f.read(65536)
-                if not data:
-                    break
-                h = crc32(data, h)
-
-            h = h & 0xFFFFFFFF
-
-        return f'{h:08x}'
+        return get_digests(path, ['crc32'])['crc32']
 
     def get_md5(self, path: str):
-        with open(path, 'rb') as f:
-            h = md5()
-
-            while True:
-                data = f.read(65536)
-                if not data:
-                    break
-                h.update(data)
-
-        return h.hexdigest()
+        return get_digests(path, ['md5'])['md5']
 
     def get_sha1(self, path: str):
-        with open(path, 'rb') as f:
-            h = sha1()
-
-            while True:
-                data = f.read(65536)
-                if not data:
-                    break
-                h.update(data)
-
-        return h.hexdigest()
+        return get_digests(path, ['sha1'])['sha1']
 
     def get_sha256(self, path: str):
-        with open(path, 'rb') as f:
-            h = sha256()
-
-            while True:
-                data = f.read(65536)
-                if not data:
-                    break
-                h.update(data)
-
-        return h.hexdigest()
+        return get_digests(path, ['sha256'])['sha256']
 
     def get_installed_apps(self):
         # https://pastebin.com/MfDPJ9AM
@@ -2291,6 +5146,45 @@ streams_files = {}
 streams_deletes = {}
 streams_finds = {}
 streams_ls = {}
+streams_hashes = {}
+streams_duplicates = {}
+streams_copies = {}
+
+# API calls run concurrently, the stream dicts are changed under this lock
+streams_lock = Lock()
+
+
+def start_stream(streams: dict[str, Stream], key: str, stream: Stream):
+    """Registers and starts `stream`, cancelling the stream it supersedes"""
+
+    with streams_lock:
+        old = streams.get(key)
+        streams[key] = stream
+
+    if old is not None:
+        old.cancel()
+
+    stream.start()
+
+    return stream
+
+
+def drop_stream(streams: dict[str, Stream], key: str, stream: Stream | None = None):
+    """Removes the stream of `key` (only if it is still `stream`), returns it"""
+
+    with streams_lock:
+        if key in streams and (stream is None or streams[key] is stream):
+            return streams.pop(key)
+
+
+def cancel_streams(streams: dict[str, Stream]):
+    with streams_lock:
+        cancelled = [*streams.values()]
+        streams.clear()
+
+    for s in cancelled:
+        s.cancel()
+
 
 DRIVE_TYPES = {
     0: 'Unknown',
@@ -2308,6 +5202,9 @@ UI_FOLDER = Path('ui')
 SEED_FOLDER = Path('seed')
 CONFIG_FILE = Path('config.toml')
 LOCAL_STORAGE = Path('localstorage.json')
+INDEX_FILE = Path('index.db')
+HASH_CACHE_FILE = Path('hashes.db')
+JOBS_FILE = Path('jobs.db')
 
 local_store_lock = Lock()
 
@@ -2327,12 +5224,88 @@ if not CONFIG_FILE.exists():
                     'text': '#fee2e2',
                     'background': '#27272a',
                     'divider': '#4b5563',
-                }
+                },
+                'cache': {
+                    'ls_max_memory': '64mb',
+                    'file_types_max_entries': 100000,
+                    'listings_max': 4,
+                    'folder_sizes_max_entries': 100000,
+                    'hashes_max_entries': 10000,
+                },
+                'index': {
+                    'roots': [],
+                    'refresh_interval': 300,
+                },
+                'find': {
+                    'workers': 8,
+                },
+                'server': {
+                    'workers': 16,
+                },
+                'jobs': {
+                    'concurrency': 2,
+                },
+                'io': {
+                    'device_slots': 8,
+                    'background_slots': 4,
+                    'background_bandwidth': '0mb',
+                },
             }
         )
     )
 
 
+def get_config_value(section: str, key: str, default):
+    try:
+        return load_toml(CONFIG_FILE).get(section, {}).get(key, default)
+    except (OSError, ValueError):
+        return default
+
+
+io_scheduler = IOScheduler(
+    get_config_value('io', 'device_slots', 8),
+    get_config_value('io', 'background_slots', 4),
+    parse_size(get_config_value('io', 'background_bandwidth', '0mb')),
+)
+
+# Keyed by (kind, lowercase name)
+file_type_cache = LRUCache(get_config_value('cache', 'file_types_max_entries', 100000))
+
+ls_cache = DirCache(parse_size(get_config_value('cache', 'ls_max_memory', '64mb')))
+
+# Sorted views of the folders for `API.get_window`
+listings = LRUCache(get_config_value('cache', 'listings_max', 4))
+
+# Line offsets of the text files paged with `API.read_lines`
+line_indexes = LRUCache(16)
+
+max_line_length = 1 << 16
+
+# Bytes returned by one `API.read_range`
+max_range_length = 8 << 20
+
+folder_sizes = FolderSizes(
+    get_config_value('cache', 'folder_sizes_max_entries', 100000)
+)
+
+hash_cache = HashCache(
+    HASH_CACHE_FILE, get_config_value('cache', 'hashes_max_entries', 10000)
+)
+
+file_index = FileIndex(
+    INDEX_FILE,
+    get_config_value('index', 'roots', []),
+    get_config_value('index', 'refresh_interval', 300),
+)
+
+job_queue = JobQueue(
+    JOBS_FILE,
+    {'delete': streams_deletes, 'copy': streams_copies},
+    get_config_value('jobs', 'concurrency', 2),
+    get_config_value('find', 'workers', 8),
+)
+
+
 def start_server():
     run('cd ui && pnpm dev', shell=True)
 
@@ -2375,65 +5348,174 @@ def start(debug=True, server=True):
     )
 
     def start_window():
+        file_index.start()
+        job_queue.start()
         w.evaluate_js(f'sessionStorage.setItem("token", "{webview.token}")')
         start_ws_server()
 
     def start_ws_server():
+        # Negotiated by each connection with a 'hello' message
+        #   columnar: listing items are sent with `to_columns`
+        #   binary: messages are msgpack binary frames (if msgpack is installed)
+        async def send(ws: WebSocketServerProtocol, options: dict, message: dict):
+            if options['binary']:
+                await ws.send(packb(message))
+            else:
+                await ws.send(dumps(message))
+
+        async def push(
+            ws: WebSocketServerProtocol, options: dict, id: str, stream: Stream
+        ):
+            subscriber = Subscriber()
+            stream.subscribe(subscriber)
+
+            # The stream can have produced items before the subscription
+            subscriber()
+
+            try:
+                while True:
+                    await subscriber.wait()
+
+                    end = stream.end
+                    items = stream.take()
+
+                    if not items and not end:
+                        continue
+
+                    if options['columnar'] and all(isinstance(i, Entry) for i in items):
+                        items = to_columns(items)
+                    else:
+                        items = to_items(items)
+
+                    # Awaiting the send is the backpressure, while the socket write buffer
+                    # drains the stream keeps buffering and the next batch gets bigger
+                    await send(
+                        ws,
+                        options,
+                        {
+                            'type': 'stream',
+                            'id': id,
+                            'items': items,
+                            **stream.status(),
+                            'end': end,
+                        },
+                    )
+
+                    if end:
+                        break
+            except (ConnectionClosedOK, ConnectionClosedError, CancelledError):
+                # Nobody else reads the stream
+                stream.cancel()
+            finally:
+                stream.unsubscribe(subscriber)
+
+        async def call(
+            ws: WebSocketServerProtocol, options: dict, id: str, name: str, args: list
+        ):
+            try:
+                r = await get_running_loop().run_in_executor(
+                    executor, getattr(api, name), *args
+                )
+            except Exception as e:
+                print_exc()
+                # The caller is waiting for the return
+                await send(
+                    ws,
+                    options,
+                    {'type': 'return', 'id': id, 'r': None, 'error': repr(e)},
+                )
+                return
+
+            # JSON has no bytes
+            if isinstance(r, bytes) and not options['binary']:
+                r = b64encode(r).decode()
+
+            await send(ws, options, {'type': 'return', 'id': id, 'r': r})
+
         async def server(ws: WebSocketServerProtocol):
-            while True:
-                try:
-                    data = loads(await ws.recv())
+            subscriptions = {}
+            calls = set()
+            options = {'columnar': False, 'binary': False}
+
+            try:
+                while True:
+                    try:
+                        data = loads(await ws.recv())
 
-                    if data['type'] == 'call':
-                        id = data['id']
-                        name = data['name']
-                        args = data['args']
                         token = data.get('token')
 
-                        if not token or token != webview.token:
+                        if data['type'] in ('call', 'subscribe') and (
+                            not token or token != webview.token
+                        ):
                             print(f'Invalid token: {token}')
                             continue
 
-                        try:
-                            r = getattr(api, name)(*args)
-                        except Exception:
-                            print_exc()
-                            continue
-
-                        await ws.send(dumps({'type': 'return', 'id': id, 'r': r}))
-                except ConnectionClosedOK:
-                    ...
-                except ConnectionClosedError as e:
-                    if str(e) != 'no close frame received or sent':
-                        raise
+                        if data['type'] == 'hello':
+                            options['columnar'] = data.get('format') == 'columnar'
+                            options['binary'] = (
+                                bool(data.get('binary')) and packb is not None
+                            )
+
+                            await ws.send(dumps({'type': 'hello', **options}))
+
+                        elif data['type'] == 'call':
+                            # Returns are sent as each call completes, matched by id
+                            task = create_task(
+                                call(
+                                    ws, options, data['id'], data['name'], data['args']
+                                )
+                            )
+                            calls.add(task)
+                            task.add_done_callback(calls.discard)
+
+                        elif data['type'] == 'subscribe':
+                            id = data['id']
+                            name = data['name']
+                            args = data['args']
+
+                            try:
+                                stream = getattr(api, f'subscribe_{name}')(*args)
+                            except Exception:
+                                print_exc()
+                                continue
+
+                            subscriptions[id] = create_task(
+                                push(ws, options, id, stream)
+                            )
+                            subscriptions[id].add_done_callback(
+                                lambda _, id=id: subscriptions.pop(id, None)
+                            )
+
+                        elif data['type'] == 'unsubscribe':
+                            if data['id'] in subscriptions:
+                                subscriptions[data['id']].cancel()
+                    except ConnectionClosedOK:
+                        break
+                    except ConnectionClosedError as e:
+                        if str(e) != 'no close frame received or sent':
+                            raise
+                        break
+            finally:
+                # Calls already running in the pool finish, their returns are dropped
+                for task in [*subscriptions.values(), *calls]:
+                    task.cancel()
 
         async def main():
-            async with serve(server, 'localhost', 3004):
+            # permessage-deflate, used when the browser offers it
+            async with serve(server, 'localhost', 3004, compression='deflate'):
                 await Future()
 
         api = API()
+        # Calls run in the pool so a slow one does not hold the other requests
+        executor = ThreadPoolExecutor(
+            max_workers=get_config_value('server', 'workers', 16)
+        )
         run_async(main())
 
     Thread(target=app.run, args=('localhost', 3003)).start()
     webview.start(start_window, debug=debug, private_mode=False)
 
 
-def parse_size(size: str):
-    size = size.lower()
-
-    if size.endswith('gb'):
-        return int(size[:-2]) * 1024 * 1024 * 1024
-
-    if size.endswith('mb'):
-        return int(size[:-2]) * 1024 * 1024
-
-    if size.endswith('kb'):
-        return int(size[:-2]) * 1024
-
-    if size.endswith('b'):
-        return int(size[:-1])
-
-
 args = sys.argv[1:]
 
 if args:
@@ -10,8 +10,8 @@ import {
 	selected,
 	sortTypeReversed,
 } from './store'
-import type { TFooter } from './types'
-import { debounce, gen_id, py, sortItems } from './utils'
+import type { ExplorerItem, TConflictPolicy, TFooter } from './types'
+import { debounce, formatBytes, gen_id, py, sleep, sortItems } from './utils'
 
 // Without this, the footer will be cleared after 5 seconds
 // even if other events are emitted
@@ -24,6 +24,11 @@ let footerDebounce = debounce(
 	5000,
 )
 
+// Incremented on each reload, items pushed for a previous reload are ignored
+let reloadId = 0
+
+let unwatch = () => {}
+
 export const E = {
 	// Update explorer items
 	reload: async () => {
@@ -37,14 +42,10 @@ export const E = {
 		const $cwd = get(cwd)
 		cwdSplit.set($cwd.split('/'))
 
-		await py.startLs($cwd)
-
-		while (true) {
-			const r = await py.ls($cwd)
-
-			if (!r) break
+		const id = ++reloadId
 
-			const { end, items: newItems } = r
+		await py.subscribeLs($cwd, ({ items: newItems }) => {
+			if (id !== reloadId) return
 
 			const $sortTypeReversed = get(sortTypeReversed)
 
@@ -57,11 +58,28 @@ export const E = {
 
 				return v
 			})
+		})
+	},
 
-			if (end) {
-				break
-			}
-		}
+	// Apply the changes of the folder to the explorer items, instead of listing it again
+	watch: (folder: string) => {
+		unwatch()
+
+		unwatch = py.subscribeWatch(folder, ({ items: deltas }) => {
+			const $sortTypeReversed = get(sortTypeReversed)
+
+			explorerItems.update(items => {
+				const changed = new Set(deltas.map(d => d.path))
+				const newItems = deltas.filter(d => d.item).map(d => d.item) as ExplorerItem[]
+				const v = sortItems([...items.filter(i => !changed.has(i.path)), ...newItems])
+
+				if ($sortTypeReversed) {
+					v.reverse()
+				}
+
+				return v
+			})
+		})
 	},
 
 	// Delete selected items
@@ -88,7 +106,41 @@ export const E = {
 		}
 
 		selected.set([])
-		await E.reload()
+	},
+
+	// Copy or move items into a folder
+	copy: async (
+		path: string | string[],
+		destination: string,
+		move = false,
+		conflict: TConflictPolicy = 'rename',
+	) => {
+		const id = gen_id()
+		const verb = move ? 'Moved' : 'Copied'
+
+		await py.startCopy(id, path, destination, move, conflict)
+
+		while (true) {
+			const r = await py.streamCopy(id)
+
+			if (!r) break
+
+			const { end, size, copied, rate, eta, last_copied } = r
+			const progress = `${formatBytes(copied)}/${formatBytes(size)}`
+			const left = eta !== null ? `, ${Math.ceil(eta)}s left` : ''
+			const speed = end ? '' : ` ${formatBytes(rate)}/s${left}`
+
+			await E.footerText({
+				text: `${verb} ${progress}${speed} ${!!last_copied ? `- ${last_copied}` : ''}`,
+				type: 'info',
+			})
+
+			if (end) {
+				break
+			}
+
+			await sleep(0.25)
+		}
 	},
 
 	// Set footer text
@@ -13,7 +13,55 @@ export type ExplorerItem = {
 	action?: 'createFile' | 'createFolder' | 'rename'
 }
 
+// Listing items sent by columns, see to_columns in main.py
+export type TColumns = {
+	name: string[]
+	kind: ('file' | 'folder')[]
+	modified: number[]
+	accessed: number[]
+	created: number[]
+	size: number[]
+	type: number[]
+	types: string[]
+	parent: number[]
+	parents: string[]
+}
+
+export type TWatchDelta = {
+	event: 'added' | 'removed' | 'modified'
+	path: string
+	item: ExplorerItem | null
+}
+
 export type TSortTypes = 'name' | 'modified' | 'type' | 'size'
+
+export type THashAlgorithm = 'crc32' | 'md5' | 'sha1' | 'sha256'
+
+export type TConflictPolicy = 'rename' | 'skip' | 'overwrite' | 'error'
+
+export type TJob = {
+	id: string
+	kind: 'delete' | 'copy'
+	args: { [key: string]: any }
+	state: 'queued' | 'running' | 'done' | 'cancelled' | 'failed'
+	status: { [key: string]: any } | null
+	created: number
+	updated: number
+}
+
+export type TDuplicateGroup = {
+	size: number
+	digest: string
+	paths: string[]
+}
+
+export type TDuplicatesStatus = {
+	stage: 'scan' | 'hash'
+	total: number
+	hashed: number
+	found: number
+	wasted: number
+}
 export type TFooter = {
 	text: string
 	type: 'info' | 'warning' | 'error' | 'none'
@@ -27,6 +75,31 @@ export type TConfig = {
 		background: string
 		divider: string
 	}
+	cache: {
+		ls_max_memory: string
+		file_types_max_entries: number
+		listings_max: number
+		folder_sizes_max_entries: number
+		hashes_max_entries: number
+	}
+	index: {
+		roots: string[]
+		refresh_interval: number
+	}
+	find: {
+		workers: number
+	}
+	server: {
+		workers: number
+	}
+	jobs: {
+		concurrency: number
+	}
+	io: {
+		device_slots: number
+		background_slots: number
+		background_bandwidth: string
+	}
 }
 
 export type TDisksInfo = {
@@ -1,7 +1,20 @@
 import { get } from 'svelte/store'
 import { E } from './event'
 import { cwd, cwdSplit, history, historyIndex, isLoading, sortType, ws } from './store'
-import type { ExplorerItem, TConfig, TDisksInfo, TInstalledApp } from './types'
+import type {
+	ExplorerItem,
+	TColumns,
+	TConfig,
+	TDisksInfo,
+	TInstalledApp,
+	TConflictPolicy,
+	TDuplicateGroup,
+	TDuplicatesStatus,
+	THashAlgorithm,
+	TJob,
+	TSortTypes,
+	TWatchDelta,
+} from './types'
 
 // https://stackoverflow.com/a/3028037
 const isVisible = (elem: any) =>
@@ -92,6 +105,35 @@ export const py = {
 		// @ts-ignore
 		return await callWsFunction('start_folder_size', path)
 	},
+	startHash: async (
+		path: string,
+		algorithms: THashAlgorithm[] = ['crc32', 'md5', 'sha1', 'sha256'],
+	): Promise<void> => {
+		// @ts-ignore
+		return await callWsFunction('start_hash', path, algorithms)
+	},
+	startDuplicates: async (path: string): Promise<void> => {
+		// @ts-ignore
+		return await callWsFunction('start_duplicates', path)
+	},
+	startCopy: async (
+		id: string,
+		paths: string | string[],
+		destination: string,
+		move = false,
+		conflict: TConflictPolicy = 'rename',
+	): Promise<void> => {
+		// @ts-ignore
+		return await callWsFunction('start_copy', id, paths, destination, move, conflict)
+	},
+	listJobs: async (): Promise<TJob[]> => {
+		// @ts-ignore
+		return await callWsFunction('list_jobs')
+	},
+	getJob: async (id: string): Promise<TJob | null> => {
+		// @ts-ignore
+		return await callWsFunction('get_job', id)
+	},
 	startDelete: async (
 		id: string,
 		path: string | string[],
@@ -100,6 +142,31 @@ export const py = {
 		// @ts-ignore
 		return await callWsFunction('start_delete', id, path, moveToTrash)
 	},
+	subscribeLs: async (
+		folder: string,
+		onItems: (r: { items: ExplorerItem[]; total: number; end: boolean }) => void,
+	): Promise<void> => {
+		return await subscribeWsStream('ls', onItems, folder)
+	},
+	subscribeFind: async (
+		path: string,
+		query: string,
+		onItems: (r: { items: ExplorerItem[]; total: number; rate: number; end: boolean }) => void,
+	): Promise<void> => {
+		return await subscribeWsStream('find', onItems, path, query)
+	},
+	subscribeDuplicates: async (
+		path: string,
+		onGroups: (r: TDuplicatesStatus & { items: TDuplicateGroup[]; end: boolean }) => void,
+	): Promise<void> => {
+		return await subscribeWsStream('duplicates', onGroups, path)
+	},
+	subscribeWatch: (
+		folder: string,
+		onDeltas: (r: { items: TWatchDelta[]; total: number; end: boolean }) => void,
+	): (() => void) => {
+		return subscribeWs('watch', onDeltas, folder)
+	},
 	ls: async (
 		folder: string,
 	): Promise<{
@@ -109,6 +176,20 @@ export const py = {
 		// @ts-ignore
 		return await callWsFunction('ls', folder)
 	},
+	getWindow: async (
+		folder: string,
+		sort: TSortTypes,
+		offset: number,
+		limit: number,
+		reverse = false,
+		filter = '',
+	): Promise<{
+		items: ExplorerItem[]
+		total: number
+	}> => {
+		// @ts-ignore
+		return await callWsFunction('get_window', folder, sort, offset, limit, reverse, filter)
+	},
 	home: async (): Promise<string> => {
 		// @ts-ignore
 		return await callWsFunction('home')
@@ -129,21 +210,62 @@ export const py = {
 		// @ts-ignore
 		return await callWsFunction('exists', path)
 	},
+	streamHash: async (
+		path: string,
+	): Promise<{
+		processed: number
+		size: number
+		digests: { [algorithm in THashAlgorithm]?: string }
+		end: boolean
+	}> => {
+		// @ts-ignore
+		return await callWsFunction('stream_hash', path)
+	},
+	streamDuplicates: async (
+		path: string,
+	): Promise<
+		TDuplicatesStatus & {
+			groups: TDuplicateGroup[]
+			end: boolean
+		}
+	> => {
+		// @ts-ignore
+		return await callWsFunction('stream_duplicates', path)
+	},
 	streamFolderSize: async (
 		path: string,
 	): Promise<{
 		size: number
+		previous: number | null
+		children: { [name: string]: number }
 		end: boolean
 	}> => {
 		// @ts-ignore
 		return await callWsFunction('stream_folder_size', path)
 	},
+	streamCopy: async (
+		id: string,
+	): Promise<{
+		end: boolean
+		total: number
+		done: number
+		size: number
+		copied: number
+		errors: number
+		rate: number
+		eta: number | null
+		last_copied: string | null
+	}> => {
+		// @ts-ignore
+		return await callWsFunction('stream_copy', id)
+	},
 	streamDelete: async (
 		id: string,
 	): Promise<{
 		end: boolean
 		total: number
 		deleted: number
+		errors: number
 		last_deleted: string
 	}> => {
 		// @ts-ignore
@@ -155,12 +277,30 @@ export const py = {
 	): Promise<{
 		end: boolean
 		total: number
+		rate: number
 		files: ExplorerItem[]
 	}> => {
 		// @ts-ignore
 		return await callWsFunction('stream_find', path)
 	},
 
+	cancelStream: async (id: string): Promise<void> => {
+		// @ts-ignore
+		return await callWsFunction('cancel_stream', id)
+	},
+
+	deleteAllStreamsCopy: async () => {
+		// @ts-ignore
+		return await callWsFunction('delete_all_streams_copy')
+	},
+	deleteAllStreamsDuplicates: async () => {
+		// @ts-ignore
+		return await callWsFunction('delete_all_streams_duplicates')
+	},
+	deleteAllStreamsHash: async () => {
+		// @ts-ignore
+		return await callWsFunction('delete_all_streams_hash')
+	},
 	deleteAllStreamsLs: async () => {
 		// @ts-ignore
 		return await callWsFunction('delete_all_streams_ls')
@@ -181,6 +321,27 @@ export const py = {
 		return await callWsFunction('delete_all_streams_delete')
 	},
 
+	fileTypeCacheStats: async (): Promise<{
+		size: number
+		maxsize: number
+		entries: number
+		hits: number
+		misses: number
+	}> => {
+		// @ts-ignore
+		return await callWsFunction('file_type_cache_stats')
+	},
+
+	indexStatus: async (): Promise<{
+		roots: string[]
+		indexed: string[]
+		folders: number
+		entries: number
+	}> => {
+		// @ts-ignore
+		return await callWsFunction('index_status')
+	},
+
 	getPathInfo: async (path: string): Promise<ExplorerItem> => {
 		// @ts-ignore
 		return await callWsFunction('get_path_info', path)
@@ -204,6 +365,22 @@ export const py = {
 		// @ts-ignore
 		return await callWsFunction('read_b64', path)
 	},
+	readRange: async (path: string, offset: number, length: number): Promise<string> => {
+		// @ts-ignore
+		return await callWsFunction('read_range', path, offset, length)
+	},
+	readLines: async (
+		path: string,
+		start: number,
+		count: number,
+	): Promise<{
+		lines: string[]
+		total: number | null
+		size: number
+	}> => {
+		// @ts-ignore
+		return await callWsFunction('read_lines', path, start, count)
+	},
 	user: async () => {
 		// @ts-ignore
 		return await callWsFunction('user')
@@ -409,15 +586,21 @@ export function callWsFunction(name: string, ...args: any[]) {
 		const response_id = gen_id(8)
 
 		function listener(event: MessageEvent) {
-			const { type, id, r } = JSON.parse(event.data) as {
+			const { type, id, r, error } = JSON.parse(event.data) as {
 				type: 'return'
 				id: string
 				r: any
+				error?: string
 			}
 
 			if (type === 'return' && id === response_id) {
 				$ws.removeEventListener('message', listener)
-				resolve(r)
+
+				if (error !== undefined) {
+					reject(new Error(`${name}: ${error}`))
+				} else {
+					resolve(r)
+				}
 			}
 		}
 
@@ -434,9 +617,89 @@ export function callWsFunction(name: string, ...args: any[]) {
 	})
 }
 
+// Items are pushed by the server as soon as they are produced, returns a function to unsubscribe
+export function subscribeWs<T>(name: string, onData: (data: T) => void, ...args: any[]) {
+	const $ws = get(ws)
+	const stream_id = gen_id(8)
+
+	function listener(event: MessageEvent) {
+		const { type, id, ...data } = JSON.parse(event.data)
+
+		if (type === 'stream' && id === stream_id) {
+			if (data.items && !Array.isArray(data.items)) {
+				data.items = fromColumns(data.items)
+			}
+
+			onData(data as T)
+		}
+	}
+
+	$ws.addEventListener('message', listener)
+	$ws.send(
+		JSON.stringify({
+			type: 'subscribe',
+			id: stream_id,
+			name,
+			args,
+			token: sessionStorage.getItem('token'),
+		}),
+	)
+
+	return () => {
+		$ws.removeEventListener('message', listener)
+		$ws.send(JSON.stringify({ type: 'unsubscribe', id: stream_id }))
+	}
+}
+
+// Same as subscribeWs, but resolves when the stream ends
+export function subscribeWsStream<T extends { end: boolean }>(
+	name: string,
+	onData: (data: T) => void,
+	...args: any[]
+) {
+	return new Promise<void>(resolve => {
+		const unsubscribe = subscribeWs<T>(
+			name,
+			data => {
+				onData(data)
+
+				if (data.end) {
+					unsubscribe()
+					resolve()
+				}
+			},
+			...args,
+		)
+	})
+}
+
+export function fromColumns(columns: TColumns): ExplorerItem[] {
+	return columns.name.map((name, i) => {
+		const parent = columns.parents[columns.parent[i]]
+
+		return {
+			name,
+			path: `${parent.replace(/\/$/, '')}/${name}`,
+			kind: columns.kind[i],
+			modified: new Date(columns.modified[i]).toISOString(),
+			accessed: new Date(columns.accessed[i]).toISOString(),
+			created: new Date(columns.created[i]).toISOString(),
+			type: columns.types[columns.type[i]],
+			size: columns.size[i],
+			parent,
+			isEditMode: false,
+		}
+	})
+}
+
 export function createWs() {
 	const _ws = new WebSocket('ws://localhost:3004')
 
+	// Ask for the listing items by columns, smaller and faster to decode
+	_ws.addEventListener('open', () => {
+		_ws.send(JSON.stringify({ type: 'hello', format: 'columnar' }))
+	})
+
 	_ws.onclose = createWs
 
 	ws.set(_ws)